@@ -0,0 +1,136 @@
+"""
+Synthetic statechart generator for benchmarks.
+
+Statecharts are generated as sismic yaml text, with controllable width, depth, number of orthogonal regions,
+transition density and label length. Generation is deterministic for a given seed.
+"""
+from __future__ import print_function
+
+import random
+import argparse
+
+
+def _padding(rng, length):
+    return "".join(rng.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(max(length, 1)))
+
+
+def _build_tree(prefix, width, depth):
+    """
+    :return: Nested (name, children) tuples of a compound state tree.
+    """
+    children = []
+    if depth > 0:
+        children = [_build_tree("{}_{}".format(prefix, ind), width, depth - 1) for ind in range(width)]
+    return prefix, children
+
+
+def _iter_names(tree):
+    name, children = tree
+    yield name
+    for child in children:
+        for inner in _iter_names(child):
+            yield inner
+
+
+def _emit_state(lines, tree, pad, transitions, parallel=False):
+    name, children = tree
+    lines.append("{}name: {}".format(pad, name))
+    if children and not parallel:
+        lines.append("{}initial: {}".format(pad, children[0][0]))
+
+    if transitions.get(name):
+        lines.append("{}transitions:".format(pad))
+        for target, event, guard, action in transitions[name]:
+            lines.append("{}- target: {}".format(pad, target))
+            lines.append("{}  event: {}".format(pad, event))
+            if guard:
+                lines.append("{}  guard: {}".format(pad, guard))
+            if action:
+                lines.append("{}  action: {}".format(pad, action))
+
+    if children:
+        lines.append("{}{}:".format(pad, "parallel states" if parallel else "states"))
+        for child in children:
+            child_lines = []
+            _emit_state(child_lines, child, pad + "  ", transitions)
+            lines.append(pad + "- " + child_lines[0][len(pad) + 2:])
+            lines.extend(child_lines[1:])
+
+
+def generate_statechart_yaml(width=3, depth=2, regions=0, density=1., label_length=12, events=5, seed=0,
+                             name="Generated"):
+    """
+    Generates the yaml text of a statechart.
+
+    :param int width: Number of children of every composite state.
+    :param int depth: Nesting depth of composite states below the root (or below each region).
+    :param int regions: Number of orthogonal regions of the root state, or 0 for a compound root.
+    :param float density: Average number of outgoing transitions per state.
+    :param int label_length: Approximate length of guard and action text, or 0 for transitions with events only.
+    :param int events: Number of distinct event names, which also bounds the transitions of every state.
+    :param int seed: Seed for the random choices of transition targets and labels.
+    :param str name: Name of the statechart.
+    :rtype: str
+    """
+    rng = random.Random(seed)
+
+    if regions:
+        trees = [_build_tree("r{}".format(ind), width, depth) for ind in range(regions)]
+    else:
+        trees = [_build_tree("s", width, depth)]
+
+    transitions = {}
+    for tree in trees:
+        # Transitions stay inside a region, so that orthogonal regions remain independent.
+        # A state never has two transitions for the same event, so that executions are deterministic.
+        names = list(_iter_names(tree))
+        for _ in range(int(round(density * len(names)))):
+            source = rng.choice(names)
+            used = set(event for _, event, _, _ in transitions.get(source, []))
+            unused = ["e{}".format(ind) for ind in range(max(events, 1)) if "e{}".format(ind) not in used]
+            if not unused:
+                continue
+
+            guard = action = ""
+            if label_length:
+                guard = "x > -1 and '{}' != ''".format(_padding(rng, label_length - 18))
+                action = "x = x + 1; y = '{}'".format(_padding(rng, label_length - 17))
+            transitions.setdefault(source, []).append((rng.choice(names), rng.choice(unused), guard, action))
+
+    lines = [
+        "statechart:",
+        "  name: {}".format(name),
+        "  preamble: x = 0",
+        "  root state:",
+    ]
+    _emit_state(lines, ("root", trees), "    ", transitions, parallel=bool(regions))
+
+    return "\n".join(lines) + "\n"
+
+
+def generate_statechart(**kwargs):
+    """
+    Same as generate_statechart_yaml, but returns a parsed sismic.model.Statechart.
+    """
+    from sismic.io import import_from_yaml
+
+    return import_from_yaml(text=generate_statechart_yaml(**kwargs))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Prints a generated statechart in yaml.")
+    parser.add_argument("--width", type=int, default=3)
+    parser.add_argument("--depth", type=int, default=2)
+    parser.add_argument("--regions", type=int, default=0)
+    parser.add_argument("--density", type=float, default=1.)
+    parser.add_argument("--label-length", type=int, default=12)
+    parser.add_argument("--events", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    print(generate_statechart_yaml(width=args.width, depth=args.depth, regions=args.regions, density=args.density,
+                                   label_length=args.label_length, events=args.events, seed=args.seed), end="")
+
+
+if __name__ == "__main__":
+    main()
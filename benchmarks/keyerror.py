@@ -0,0 +1,110 @@
+"""
+Micro-benchmark of action execution with KeyErrors disabled.
+
+Times a small action executed by the evaluator hook of disable_keyerror_in_actions, against the previous
+implementation that copied the whole interpreter context into a NoKeyErrorDict on every action, for growing context
+sizes.
+
+Usage: python benchmarks/keyerror.py [--sizes 10,1000,100000] [--number N]
+"""
+from __future__ import print_function
+
+import os
+import sys
+import json
+import argparse
+from timeit import default_timer
+
+repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, repo_dir)
+
+import sismic_viz  # noqa: E402
+
+statechart = """statechart:
+  name: KeyError
+  root state:
+    name: root
+"""
+
+action = "x = x + 1\ny = undefined_name()"
+
+
+class LegacyNoKeyErrorDict(dict):
+    """
+    The NoKeyErrorDict that disable_keyerror_in_actions used before, kept here for comparison.
+    """
+    def __init__(self, globals_, locals_):
+        dict.__init__(self, globals_, **locals_)
+        self.globals_ = globals_
+        self.locals_ = locals_
+
+    def __setitem__(self, name, value):
+        self.locals_[name] = value
+
+    def __getitem__(self, name):
+        try:
+            return self.locals_[name]
+        except KeyError:
+            try:
+                return self.globals_[name]
+            except KeyError:
+                return sismic_viz.CallMe()
+
+
+def legacy_execute(evaluator, compiled_code, additional_context=None):
+    exposed_context = {
+        'active': evaluator._time_provider.active,
+        'time': evaluator._time_provider.time,
+        'send': evaluator._event_provider.send,
+        'notify': evaluator._event_provider.notify,
+        'setdefault': evaluator._setdefault,
+    }
+    exposed_context.update(additional_context if additional_context is not None else {})
+    exec(compiled_code, LegacyNoKeyErrorDict(exposed_context, evaluator._context))
+
+
+def get_interpreter(size):
+    from sismic.io import import_from_yaml
+    from sismic.interpreter import Interpreter
+
+    interp = Interpreter(import_from_yaml(text=statechart))
+    interp.context.update(("v{}".format(ind), ind) for ind in range(size))
+    interp.context["x"] = 0
+    sismic_viz.interp = interp
+    sismic_viz.disable_keyerror_in_actions()
+    return interp
+
+
+def time_per_call(func, number):
+    start = default_timer()
+    for _ in range(number):
+        func()
+    return (default_timer() - start) / number * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=str, default="10,1000,100000",
+                        help="Comma separated context sizes. Default: 10,1000,100000.")
+    parser.add_argument("--number", type=int, default=200, help="Number of actions per measurement. Default: 200.")
+    args = parser.parse_args()
+
+    compiled_code = compile(action, "<action>", "exec")
+    results = {}
+    for size in [int(size) for size in args.sizes.split(",")]:
+        interp = get_interpreter(size)
+        evaluator = interp._evaluator
+        additional_context = {"event": None}
+
+        results[size] = {
+            "legacy_us": time_per_call(
+                lambda: legacy_execute(evaluator, compiled_code, additional_context), args.number),
+            "current_us": time_per_call(
+                lambda: evaluator._execute_code(action, additional_context=additional_context), args.number),
+        }
+
+    print(json.dumps(results, indent=2, sort_keys=True))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,214 @@
+"""
+Benchmark suite for sismic_viz.
+
+Times export_to_dot, create_image, the server_to_bind callback and the HTTP endpoints of both servers, on statecharts
+made by the generator module. Results are written as JSON, and can be compared to the results of another run.
+
+Usage:
+    python benchmarks/run.py [--cases small,wide] [--repeat N] [--output results.json] [--compare baseline.json]
+"""
+from __future__ import print_function
+
+import os
+import sys
+import json
+import random
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+import threading
+from timeit import default_timer
+
+repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, repo_dir)
+
+import sismic_viz  # noqa: E402
+from generator import generate_statechart  # noqa: E402
+
+cases = [
+    ("small", dict(width=3, depth=1)),
+    ("deep", dict(width=2, depth=5)),
+    ("wide", dict(width=40, depth=1)),
+    ("parallel", dict(regions=8, width=3, depth=2)),
+    ("dense", dict(width=6, depth=2, density=4.)),
+    ("long-labels", dict(width=4, depth=2, label_length=120)),
+]
+
+
+def measure(func, repeat, setup=None):
+    """
+    Calls func repeat times, with setup before every call, and returns statistics of the calls durations.
+    """
+    durations = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = default_timer()
+        func()
+        durations.append((default_timer() - start) * 1000)
+
+    durations.sort()
+    return {
+        "min_ms": durations[0],
+        "median_ms": durations[len(durations) // 2],
+        "mean_ms": sum(durations) / len(durations),
+        "runs": len(durations),
+    }
+
+
+def clear_render_cache():
+    sismic_viz.render_cache = sismic_viz.RenderCache()
+
+
+def get_initial_interpreter(sc):
+    from sismic.interpreter import Interpreter
+
+    interp = Interpreter(sc)
+    interp.execute()
+    return interp
+
+
+def record_metaevents(sc, steps, seed=0):
+    """
+    Runs an interpreter on random events, and returns the metaevents it sent.
+    """
+    from sismic.interpreter import Interpreter
+
+    metaevents = []
+    interp = Interpreter(sc)
+    interp.attach(metaevents.append)
+    interp.execute()
+
+    rng = random.Random(seed)
+    events = sorted(set(transition.event for transition in sc.transitions if transition.event))
+    for _ in range(steps):
+        if events:
+            interp.queue(rng.choice(events))
+        interp.clock.time += 1
+        interp.execute()
+    return metaevents
+
+
+def bench_case(sc, repeat, has_dot, tmpdir):
+    results = {}
+    interp = get_initial_interpreter(sc)
+    configuration = interp.configuration
+    imagepath = os.path.join(tmpdir, "statechart.svg")
+    image_options = dict(sismic_viz.global_config, file_type="dot")
+
+    results["export_to_dot"] = measure(lambda: sismic_viz.export_to_dot(sc, configuration=configuration), repeat)
+
+    if has_dot:
+        results["create_image"] = measure(
+            lambda: sismic_viz.create_image(sc, configuration, image_options, imagepath), repeat,
+            setup=clear_render_cache)
+        results["create_image_cached"] = measure(
+            lambda: sismic_viz.create_image(sc, configuration, image_options, imagepath), repeat)
+
+    metaevents = record_metaevents(sc, steps=200)
+
+    def replay():
+        view = sismic_viz.BoundStatechartView()
+        for metaevent in metaevents:
+            view(metaevent)
+
+    results["bound_callback"] = measure(replay, repeat)
+    results["bound_callback"]["metaevents"] = len(metaevents)
+
+    view = sismic_viz.BoundStatechartView()
+    for metaevent in metaevents:
+        view(metaevent)
+    bound_client = sismic_viz.get_bound_flask_app(sc, view, imagepath, threading.Event(), logging=False).test_client()
+    results["http_bound_clock"] = measure(lambda: bound_client.get("/clock"), repeat)
+    results["http_bound_history"] = measure(lambda: bound_client.get("/history"), repeat)
+
+    if has_dot:
+        results["http_bound_index"] = measure(lambda: bound_client.get("/"), repeat)
+        results["http_bound_svg"] = measure(lambda: bound_client.get("/statechart.svg"), repeat)
+
+        sismic_viz.interp = get_initial_interpreter(sc)
+        sismic_viz.imagefile_path = imagepath
+        sismic_viz.global_config["history"] = []
+        interactive_client = sismic_viz.get_flask_app().test_client()
+        events = sorted(set(transition.event for transition in sc.transitions if transition.event))
+        results["http_interactive_index"] = measure(lambda: interactive_client.get("/"), repeat)
+        if events:
+            results["http_interactive_event"] = measure(
+                lambda: interactive_client.get("/", query_string={"event": events[0]}), repeat)
+        results["http_interactive_svg"] = measure(lambda: interactive_client.get("/statechart.svg"), repeat)
+
+    return results
+
+
+def get_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=repo_dir).decode("utf-8").strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_comparison(results, baseline):
+    print("{:<14} {:<24} {:>12} {:>12} {:>8}".format("case", "benchmark", "baseline ms", "current ms", "ratio"))
+    for case, benchmarks in results["cases"].items():
+        for name, stats in benchmarks.items():
+            old = baseline.get("cases", {}).get(case, {}).get(name)
+            if old is None:
+                continue
+            print("{:<14} {:<24} {:>12.3f} {:>12.3f} {:>8.2f}".format(
+                case, name, old["median_ms"], stats["median_ms"], stats["median_ms"] / max(old["median_ms"], 1e-9)))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--cases", type=str, default=None,
+                        help="Comma separated names of cases to run. Default: all of {}.".format(
+                            ", ".join(name for name, _ in cases)))
+    parser.add_argument("--repeat", type=int, default=10, help="Number of calls per benchmark. Default: 10.")
+    parser.add_argument("--output", type=str, default=None, help="Path to write JSON results to.")
+    parser.add_argument("--compare", type=str, default=None, help="Path to JSON results of a previous run.")
+    args = parser.parse_args()
+
+    selected = args.cases.split(",") if args.cases else [name for name, _ in cases]
+    has_dot = shutil.which("dot") is not None if hasattr(shutil, "which") else True
+    if not has_dot:
+        print("dot not found, skipping benchmarks that render images", file=sys.stderr)
+
+    # Measure rendering itself, rather than the on-disk caches.
+    sismic_viz.cache_dir = None
+
+    results = {
+        "commit": get_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "repeat": args.repeat,
+        "states": {},
+        "cases": {},
+    }
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        for name, params in cases:
+            if name not in selected:
+                continue
+            sc = generate_statechart(**params)
+            results["cases"][name] = bench_case(sc, args.repeat, has_dot, tmpdir)
+            results["states"][name] = len(sc.states)
+            print("{}: done".format(name), file=sys.stderr)
+    finally:
+        shutil.rmtree(tmpdir)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    else:
+        print(json.dumps(results, indent=2, sort_keys=True))
+
+    if args.compare:
+        with open(args.compare) as f:
+            print_comparison(results, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
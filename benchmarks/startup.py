@@ -0,0 +1,93 @@
+"""
+Startup-time benchmark for sismic_viz.
+
+Measures, in fresh python processes, the time to import sismic_viz and the time of a complete static export of a
+small statechart to a dot file. Exits with a non-zero status if the import pulls in a module that only the server or
+the interpreter need, or if a median time exceeds its budget.
+
+Usage: python benchmarks/startup.py [--repeat N] [--max-import-ms MS] [--max-export-ms MS]
+"""
+from __future__ import print_function
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules that a static export must not import.
+lazy_modules = ["flask", "werkzeug", "webbrowser", "sismic.interpreter", "sismic.io"]
+
+small_statechart = """statechart:
+  name: Startup
+  root state:
+    name: root
+    initial: a
+    states:
+    - name: a
+      transitions:
+      - target: b
+        event: go
+    - name: b
+"""
+
+
+def run_python(code, env):
+    start = time.time()
+    output = subprocess.check_output([sys.executable, "-c", code], cwd=repo_dir, env=env)
+    return time.time() - start, output
+
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=10, help="Number of processes per measurement. Default: 10.")
+    parser.add_argument("--max-import-ms", type=float, default=None, help="Fail if import takes longer.")
+    parser.add_argument("--max-export-ms", type=float, default=None, help="Fail if static export takes longer.")
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        env = dict(os.environ, SISMIC_VIZ_CACHE_DIR=os.path.join(tmpdir, "cache"))
+        input_file = os.path.join(tmpdir, "startup.yaml")
+        with open(input_file, "w") as f:
+            f.write(small_statechart)
+
+        _, output = run_python("import sys, json, sismic_viz; print(json.dumps(sorted(sys.modules)))", env)
+        loaded = set(json.loads(output.decode("utf-8")))
+        unexpected = [name for name in lazy_modules if name in loaded]
+
+        import_times = [run_python("import sismic_viz", env)[0] for _ in range(args.repeat)]
+
+        export_code = "import sys, sismic_viz; sys.argv = ['sismic_viz', {!r}, '-o', {!r}]; sismic_viz.main()".format(
+            input_file, os.path.join(tmpdir, "startup.dot"))
+        export_times = [run_python(export_code, env)[0] for _ in range(args.repeat)]
+    finally:
+        shutil.rmtree(tmpdir)
+
+    results = {
+        "import_ms": median(import_times) * 1000,
+        "export_ms": median(export_times) * 1000,
+        "unexpected_modules": unexpected,
+    }
+    print(json.dumps(results, indent=2))
+
+    failed = bool(unexpected)
+    if args.max_import_ms is not None and results["import_ms"] > args.max_import_ms:
+        failed = True
+    if args.max_export_ms is not None and results["export_ms"] > args.max_export_ms:
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
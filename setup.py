@@ -18,6 +18,6 @@ if __name__ == "__main__":
             "Programming Language :: Python :: 3",
         ],
         py_modules=["sismic_viz"],
-        python_requires=">=2.7.10",
+        python_requires=">=3.3",
         install_requires=["sismic", "flask", "future"],
     )
@@ -1,31 +1,152 @@
 from __future__ import print_function
 
 import os
+import re
+import sys
+import copy
+import glob
+import stat
+import json
 import time
-import shutil
+import queue
+import atexit
 import pprint
+import pickle
+import hashlib
 import argparse
-import webbrowser
+import threading
+import subprocess
+import builtins
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+from collections import OrderedDict
 from contextlib import contextmanager
+from timeit import default_timer
 
-from flask import Flask, send_file, request
-from sismic.io import import_from_yaml, export_to_plantuml
-from sismic.model import Event, CompositeStateMixin, CompoundState
-from sismic.interpreter import Interpreter
+import sismic
+from sismic.model import Event, CompositeStateMixin, CompoundState, OrthogonalState, HistoryStateMixin
 import tempfile
 
+# Flask, webbrowser, sismic.io and sismic.interpreter are imported where they are used, so that static exports
+# don't pay for importing them.
+
 yaml_filepath = None
 imagefile_path = ""
-interp = None  # type: Interpreter
+interp = None  # type: sismic.interpreter.Interpreter
 global_config = {
     "file_type": "dot",
     "edge_fontsize": 14,
     "include_guards": True,
     "include_actions": True,
     "disable_keyerror": True,
+    "focus": None,
+    "max_depth": None,
+    "collapse_inactive": False,
+    "split_regions": False,
+    "precompile": False,
+    "layout_timeout": None,
+    "lean_labels": False,
+    "prerender": False,
     "history": []
 }
 
+# Directory to write a copy of every dot document rendered by create_image to, or None to disable the copies.
+debug_dump_dir = os.environ.get("SISMIC_VIZ_DEBUG_DIR") or None
+
+# Directory for on-disk caches, or None to disable them.
+cache_dir = os.environ.get("SISMIC_VIZ_CACHE_DIR") or os.path.join(
+    os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache"), "sismic-viz")
+
+
+class Metrics(object):
+    """
+    Thread-safe registry of counters, gauges and histograms, that renders in the Prometheus text exposition format.
+    Every metric is declared once with describe, and its samples are identified by keyword labels.
+    """
+    buckets = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1., 2.5, 5., 10.)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._descriptions = OrderedDict()
+        self._samples = {}
+
+    def describe(self, name, metric_type, description):
+        self._descriptions[name] = (metric_type, description)
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._samples[key] = self._samples.get(key, 0) + amount
+
+    def set(self, name, value, **labels):
+        with self._lock:
+            self._samples[(name, tuple(sorted(labels.items())))] = value
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._samples.get(key)
+            if histogram is None:
+                histogram = self._samples[key] = [[0] * len(self.buckets), 0., 0]
+            for ind, bound in enumerate(self.buckets):
+                if value <= bound:
+                    histogram[0][ind] += 1
+            histogram[1] += value
+            histogram[2] += 1
+
+    @contextmanager
+    def timer(self, name, **labels):
+        start = default_timer()
+        try:
+            yield
+        finally:
+            self.observe(name, default_timer() - start, **labels)
+
+    def to_prometheus(self):
+        def format_labels(labels, **extra):
+            labels = list(labels) + sorted(extra.items())
+            if not labels:
+                return ""
+            return "{{{}}}".format(",".join(
+                "{}=\"{}\"".format(key, str(value).replace("\\", "\\\\").replace("\"", "\\\""))
+                for key, value in labels))
+
+        with self._lock:
+            samples = sorted(((key, [list(value[0]), value[1], value[2]] if isinstance(value, list) else value)
+                              for key, value in self._samples.items()), key=lambda item: item[0])
+
+        lines = []
+        for name, (metric_type, description) in self._descriptions.items():
+            lines.append("# HELP {} {}".format(name, description))
+            lines.append("# TYPE {} {}".format(name, metric_type))
+            for (sample_name, labels), value in samples:
+                if sample_name != name:
+                    continue
+                if metric_type == "histogram":
+                    for bound, count in zip(self.buckets, value[0]):
+                        lines.append("{}_bucket{} {}".format(name, format_labels(labels, le=bound), count))
+                    lines.append("{}_bucket{} {}".format(name, format_labels(labels, le="+Inf"), value[2]))
+                    lines.append("{}_sum{} {}".format(name, format_labels(labels), value[1]))
+                    lines.append("{}_count{} {}".format(name, format_labels(labels), value[2]))
+                else:
+                    lines.append("{}{} {}".format(name, format_labels(labels), value))
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+metrics.describe("sismic_viz_phase_seconds", "histogram",
+                 "Time spent in each phase of rendering a statechart: export_to_dot, layout and file_io.")
+metrics.describe("sismic_viz_request_seconds", "histogram", "Time spent handling HTTP requests, per endpoint.")
+metrics.describe("sismic_viz_render_cache_hits_total", "counter", "Renders served from the render cache.")
+metrics.describe("sismic_viz_render_cache_misses_total", "counter", "Renders that ran graphviz.")
+metrics.describe("sismic_viz_disk_cache_hits_total", "counter",
+                 "Renders served from the on-disk render cache, after a miss of the in-memory render cache.")
+metrics.describe("sismic_viz_callback_metaevents_total", "counter",
+                 "Metaevents received by server_to_bind callbacks.")
+metrics.describe("sismic_viz_history_size", "gauge", "Number of entries in the displayed history.")
+metrics.describe("sismic_viz_layout_fallbacks_total", "counter",
+                 "Images rendered with a cheaper layout because dot exceeded the layout timeout, per fallback.")
+
 
 def indent(s):
     return '\n'.join('  ' + line for line in s.splitlines())
@@ -40,7 +161,7 @@ template_graph_doc = """digraph {{
 template_cluster = """
 subgraph cluster_{state_name} {{
   label = "{state_name}"
-  color = {color}
+  color = {color}{element_id}
  {style}
   node [shape=Mrecord width=.4 height=.4];{inner_nodes}{initial}{additional_points}
 }}"""
@@ -53,21 +174,106 @@ template_invisible = """
   node [shape=point style=invisible width=0 height=0];
   invisible_{state_name}"""
 
-template_leaf = "\n{state_name} [label={label} shape=Mrecord{style} color={color}]"
+template_leaf = "\n{state_name} [label={label} shape=Mrecord{style} color={color}{element_id}]"
 
 template_leaf_table_label = """\n{state_name} [label=<
   <table cellborder="0" style="rounded"{bgcolor}>
     <tr><td>{state_name}</td></tr>
     <hr/>{on_entry}{on_exit}
   </table>
-> shape=none margin=0]"""
+> shape=none margin=0{element_id}]"""
+
+template_transition = "\n{source} -> {target} [label=\"{label}\"{tooltip}{ltail}{lhead}{dir}{color}{element_id}]"
+template_tooltip = " tooltip=\"{text}\" labeltooltip=\"{text}\""
+
+
+template_collapsed = "\n{state_name} [label=\"{state_name} ...\" shape=box3d{style} color={color}{element_id}]"
+
+# Ids and classes of svg elements, with export_to_dot(element_ids=True).
+template_state_id = " id=\"state_{state_name}\""
+template_cluster_id = "\n  id = \"state_{state_name}\""
+template_transition_id = " id=\"transition_{state_name}_{ind}{segment}\" class=\"from_{state_name}\""
+
+template_port = "\nport_{state_name} [label=\"{state_name}\" shape=cds style=dashed fontsize=10]"
+
+
+def get_collapsed_states(sc, root, max_depth=None, configuration=(), collapse_inactive=False):
+    """
+    Returns the composite states in the subtree of root that are drawn as a single node, either because they are
+    max_depth levels below root, or because they are inactive and collapse_inactive is set. The descendants of these
+    states are not drawn.
+
+    :param sismic.model.Statechart sc: Statechart.
+    :param str root: Name of the state at the top of the drawing.
+    :param int max_depth: Number of levels drawn below root, or None for all levels.
+    :param configuration: Names of active states.
+    :param bool collapse_inactive: Whether to collapse composite states that have no active descendant.
+    :rtype: set
+    """
+    collapsed = set()
+    if max_depth is None and not collapse_inactive:
+        return collapsed
+
+    level = [root]
+    depth = 0
+    while level:
+        if max_depth is not None and depth >= max_depth:
+            collapsed.update(name for name in level if isinstance(sc.state_for(name), CompositeStateMixin))
+            break
+
+        next_level = []
+        for name in level:
+            # A composite state is active exactly when one of its descendants is.
+            if (collapse_inactive and name != root and name not in configuration
+                    and isinstance(sc.state_for(name), CompositeStateMixin)):
+                collapsed.add(name)
+            else:
+                next_level.extend(sc.children_for(name))
+        level = next_level
+        depth += 1
+    return collapsed
+
+
+def get_visible_state(sc, state_name, root, collapsed=()):
+    """
+    Returns the name of the node that represents state_name in a drawing of the subtree of root: the state itself,
+    its outermost collapsed ancestor, or None if the state is not in the subtree.
+    """
+    visible = state_name
+    if state_name == root:
+        return visible
+
+    for ancestor in sc.ancestors_for(state_name):
+        if ancestor in collapsed:
+            visible = ancestor
+        if ancestor == root:
+            return visible
+    return None
 
-template_transition = "\n{source} -> {target} [label=\"{label}\"{ltail}{lhead}{dir}{color}]"
 
+def get_additional_points(sc, state_names, collapsed=()):
+    return '\n'.join(
+        "  point_{child}_{ind}".format(child=child, ind=ind)
+        for child in state_names
+        if child not in collapsed
+        for ind, transition in enumerate(sc.transitions_from(child))
+        if transition.target in sc.descendants_for(child))
 
-def visit_state(sc, state_name, configuration=()):
+
+def visit_state(sc, state_name, configuration=(), collapsed=(), element_ids=False):
     state = sc.state_for(state_name)
     active = state_name in configuration
+    element_id = template_state_id.format(state_name=state_name) if element_ids else ""
+
+    if state_name in collapsed:
+        if active:
+            color = "\"#3399ff\""
+            style = " style=filled"
+        else:
+            color = "black"
+            style = ""
+
+        return template_collapsed.format(state_name=state_name, style=style, color=color, element_id=element_id)
 
     if isinstance(state, CompositeStateMixin):
         color = "\"#3399ff\"" if active else "black"
@@ -83,20 +289,19 @@ def visit_state(sc, state_name, configuration=()):
         if sc.transitions_to(state_name) or sc.transitions_from(state_name):
             initial = "{}{}".format(initial, template_invisible.format(state_name=state_name))
 
-        inner_nodes = '\n'.join(indent(visit_state(sc, inner, configuration=configuration))
+        inner_nodes = '\n'.join(indent(visit_state(sc, inner, configuration=configuration, collapsed=collapsed,
+                                                    element_ids=element_ids))
                                 for inner in sc.children_for(state_name))
 
-        additional_points = '\n'.join(
-            "  point_{child}_{ind}".format(child=child, ind=ind)
-            for child in sc.children_for(state_name)
-            for ind, transition in enumerate(sc.transitions_from(child))
-            if transition.target in sc.descendants_for(child))
+        additional_points = get_additional_points(sc, sc.children_for(state_name), collapsed)
         if additional_points:
             additional_points = '\n{}\n{}'.format("  node [shape=point margin=0 style=invis width=0. height=0.]",
                                                   additional_points)
 
         return template_cluster.format(state_name=state_name, initial=initial, inner_nodes=inner_nodes,
-                                       style=style, additional_points=additional_points, color=color)
+                                       style=style, additional_points=additional_points, color=color,
+                                       element_id=template_cluster_id.format(state_name=state_name)
+                                       if element_ids else "")
 
     if state.on_entry or state.on_exit:
         bgcolor = " bgcolor=\"#3399ff\"" if active else ""
@@ -104,7 +309,7 @@ def visit_state(sc, state_name, configuration=()):
         on_exit = "\n    <tr><td>exit / {}</td></tr>".format(state.on_exit) if state.on_exit else ""
 
         return template_leaf_table_label.format(state_name=state_name, bgcolor=bgcolor,
-                                                on_entry=on_entry, on_exit=on_exit)
+                                                on_entry=on_entry, on_exit=on_exit, element_id=element_id)
     else:
         if active:
             color = "\"#3399ff\""
@@ -115,13 +320,14 @@ def visit_state(sc, state_name, configuration=()):
 
         label = "\"{}\"".format(state_name)
 
-        return template_leaf.format(state_name=state_name, label=label, style=style, color=color)
+        return template_leaf.format(state_name=state_name, label=label, style=style, color=color,
+                                    element_id=element_id)
 
 
-def get_valid_nodes(sc, state_name):
+def get_valid_nodes(sc, state_name, collapsed=()):
     state = sc.state_for(state_name)
 
-    if isinstance(state, CompositeStateMixin):
+    if isinstance(state, CompositeStateMixin) and state_name not in collapsed:
         return "invisible_{}".format(state_name), "cluster_{}".format(
             state_name
         )
@@ -129,7 +335,7 @@ def get_valid_nodes(sc, state_name):
     return state_name, state_name
 
 
-def get_edge_text(source, target, ltail, lhead, label, dir_, color):
+def get_edge_text(source, target, ltail, lhead, label, dir_, color, tooltip="", element_id=""):
     if ltail == source:
         ltail = ""
     else:
@@ -140,52 +346,142 @@ def get_edge_text(source, target, ltail, lhead, label, dir_, color):
     else:
         lhead = " lhead={}".format(lhead)
 
-    return template_transition.format(source=source, target=target,
-                                      ltail=ltail, lhead=lhead, label=label, dir=dir_, color=color)
+    if tooltip:
+        tooltip = template_tooltip.format(text=tooltip)
+
+    return template_transition.format(source=source, target=target, ltail=ltail, lhead=lhead, label=label,
+                                      tooltip=tooltip, dir=dir_, color=color, element_id=element_id)
+
 
+def get_edges(sc, include_guards, include_actions, configuration=(), root=None, collapsed=(), ports=None,
+              lean_labels=False, element_ids=False):
+    """
+    Returns the edges of the transitions in the subtree of root. Transitions from or to states inside a collapsed
+    state are attached to the collapsed state, and transitions from or to states outside of the subtree are attached
+    to boundary ports, whose state names are added to ports. With lean_labels, edges are labeled with their event
+    only, and the guard and action are put in the edge tooltip. With element_ids, edges of transitions with an event
+    have the class from_<state name>, for the state whose activity colors them.
+    """
+    root = sc.root if root is None else root
+    ports = set() if ports is None else ports
+    subtree = set(sc.descendants_for(root))
+    subtree.add(root)
+
+    transitions = [(state_name, ind, transition)
+                   for state_name in sc.states if state_name in subtree
+                   for ind, transition in enumerate(sc.transitions_from(state_name))]
+    if root != sc.root:
+        transitions.extend((transition.source, None, transition)
+                           for state_name in sc.states if state_name in subtree
+                           for transition in sc.transitions_to(state_name)
+                           if transition.source not in subtree)
 
-def get_edges(sc, include_guards, include_actions, configuration=()):
     edges = []
-    for state_name in sc.states:
-        for ind, transition in enumerate(sc.transitions_from(state_name)):
-            if not transition.target:
-                continue
-            
-            valid_source, source = get_valid_nodes(sc, transition.source)
-            valid_target, target = get_valid_nodes(sc, transition.target)
-
-            color = ""
-            label_parts = []
-
-            if transition.event:
-                label_parts.append(transition.event)
-                if state_name in configuration:
-                    color = " color=\"#3399ff\""
-            if include_guards and transition.guard:
-                label_parts.append('[{}]'.format(transition.guard.replace('"', '\\"')))
-            if include_actions and transition.action:
-                label_parts.append('/ {}'.format(transition.action.replace('"', '\\"')))
-
-            label = " ".join(label_parts)
-
-            if transition.target in sc.descendants_for(state_name):
-                out_point = "point_{}_{}".format(state_name, ind)
-                edges.append(get_edge_text(source=valid_source, target=out_point,
-                                           ltail=source, lhead=out_point, label="", dir_=" dir=none", color=color))
-                edges.append(get_edge_text(source=out_point, target=valid_target,
-                                           ltail=out_point, lhead=target, label=label, dir_="", color=color))
-            else:
-                edges.append(get_edge_text(source=valid_source, target=valid_target,
-                                           ltail=source, lhead=target, label=label, dir_="", color=color))
+    for state_name, ind, transition in transitions:
+        if not transition.target:
+            continue
+
+        visible_source = get_visible_state(sc, transition.source, root, collapsed)
+        visible_target = get_visible_state(sc, transition.target, root, collapsed)
+
+        # Transitions between states that are hidden in the same collapsed state are not drawn.
+        if (visible_source == visible_target and visible_source in collapsed
+                and not transition.source == transition.target == visible_source):
+            continue
+
+        if visible_source is None:
+            ports.add(transition.source)
+            valid_source = source = "port_{}".format(transition.source)
+        else:
+            valid_source, source = get_valid_nodes(sc, visible_source, collapsed)
+
+        if visible_target is None:
+            ports.add(transition.target)
+            valid_target = target = "port_{}".format(transition.target)
+        else:
+            valid_target, target = get_valid_nodes(sc, visible_target, collapsed)
+
+        color = ""
+        label_parts = []
+
+        if transition.event:
+            label_parts.append(transition.event)
+            if state_name in configuration:
+                color = " color=\"#3399ff\""
+        if include_guards and transition.guard:
+            label_parts.append('[{}]'.format(transition.guard.replace('"', '\\"')))
+        if include_actions and transition.action:
+            label_parts.append('/ {}'.format(transition.action.replace('"', '\\"')))
+
+        label = " ".join(label_parts)
+        tooltip = ""
+        if lean_labels and len(label_parts) > int(bool(transition.event)):
+            tooltip = label
+            label = transition.event or ""
+
+        element_id = out_element_id = ""
+        if element_ids and transition.event:
+            element_id = template_transition_id.format(state_name=state_name, ind=ind, segment="")
+            out_element_id = template_transition_id.format(state_name=state_name, ind=ind, segment="_out")
+
+        if visible_source == state_name and visible_target in sc.descendants_for(state_name):
+            out_point = "point_{}_{}".format(state_name, ind)
+            edge = (get_edge_text(source=valid_source, target=out_point, ltail=source, lhead=out_point, label="",
+                                  dir_=" dir=none", color=color, element_id=out_element_id) +
+                    get_edge_text(source=out_point, target=valid_target, ltail=out_point, lhead=target, label=label,
+                                  dir_="", color=color, tooltip=tooltip, element_id=element_id))
+        else:
+            edge = get_edge_text(source=valid_source, target=valid_target, ltail=source, lhead=target, label=label,
+                                 dir_="", color=color, tooltip=tooltip, element_id=element_id)
+
+        # Collapsing may reroute several transitions to the same edge.
+        if edge not in edges:
+            edges.append(edge)
 
     return "".join(edges)
 
 
-def export_to_dot(sc, include_guards=True, include_actions=True, edge_fontsize=14, configuration=()):
-    nodes = indent(visit_state(sc, sc.root, configuration=configuration))
-    edges = indent(get_edges(sc, include_guards, include_actions, configuration=configuration))
+def export_to_dot(sc, include_guards=True, include_actions=True, edge_fontsize=14, configuration=(), focus=None,
+                  max_depth=None, collapse_inactive=False, lean_labels=False, element_ids=False):
+    """
+    Exports a statechart to dot source.
+
+    :param sismic.model.Statechart sc: Statechart to export.
+    :param bool include_guards: Whether to show transition guards.
+    :param bool include_actions: Whether to show transition actions.
+    :param int edge_fontsize: Font size of text on transitions.
+    :param configuration: Names of active states, drawn in color.
+    :param str focus: Name of a state to draw with its descendants only, instead of the whole statechart.
+        Transitions from or to states outside of it end at boundary ports.
+    :param int max_depth: Number of levels drawn below the focused state. Composite states at the last level are
+        drawn as a single node. Default: all levels.
+    :param bool collapse_inactive: Whether to draw composite states with no active descendant as a single node, so
+        that only the parts of the statechart around the active configuration are expanded.
+    :param bool lean_labels: Whether to label transitions with their event only, and show their guard and action in
+        a tooltip instead, which makes layouts faster and smaller.
+    :param bool element_ids: Whether to give states the svg id state_<name>, and transitions with an event the svg
+        class from_<name> of their source, so that the configuration can be highlighted with CSS.
+    :rtype: str
+    """
+    with metrics.timer("sismic_viz_phase_seconds", phase="export_to_dot"):
+        root = sc.root if focus is None else sc.state_for(focus).name
+        collapsed = get_collapsed_states(sc, root, max_depth=max_depth, configuration=configuration,
+                                         collapse_inactive=collapse_inactive)
+        ports = set()
+
+        nodes = visit_state(sc, root, configuration=configuration, collapsed=collapsed, element_ids=element_ids)
+        edges = get_edges(sc, include_guards, include_actions, configuration=configuration, root=root,
+                          collapsed=collapsed, ports=ports, lean_labels=lean_labels, element_ids=element_ids)
+
+        if root != sc.root:
+            root_points = get_additional_points(sc, [root], collapsed)
+            if root_points:
+                nodes = '{}\n{}\n{}'.format(nodes, "  node [shape=point margin=0 style=invis width=0. height=0.]",
+                                             root_points)
+            nodes += "".join(template_port.format(state_name=state_name) for state_name in sorted(ports))
 
-    return template_graph_doc.format(name=sc.name, nodes=nodes, edges=edges, fontsize=edge_fontsize)
+        return template_graph_doc.format(name=sc.name, nodes=indent(nodes), edges=indent(edges),
+                                         fontsize=edge_fontsize)
 
 
 template_option = """                    <option{selected}>{size}</option>"""
@@ -201,16 +497,28 @@ template_html_doc = """<html>
     </head>
     <body>
         <div>
-            <img src="statechart.svg?{timestamp}" style="max-width:100%; height:auto;"/>
+            <object data="statechart.svg?{timestamp}" type="image/svg+xml" style="max-width:100%; height:auto;">
+            </object>
+        </div>{layout_note}
+        <div>
+            Focus: {focus_path}{focus_children}
         </div>
         <div>
             <form method="get">
                 <input type="checkbox" name="include_guards" value="True"{include_guards_checked}/> Show Guards,
                 <input type="checkbox" name="include_actions" value="True"{include_actions_checked}/> Show Actions,
+                <input type="checkbox" name="lean_labels" value="True"{lean_labels_checked}/>
+                Guards and Actions in Tooltips,
                 Font Size: 
                 <select name="edge_fontsize">
 {font_options}
                 </select>,
+                Depth:
+                <select name="max_depth">
+{depth_options}
+                </select>,
+                <input type="checkbox" name="collapse_inactive" value="True"{collapse_inactive_checked}/>
+                Collapse Inactive States,
                 <input type="checkbox" name="disable_keyerror" value="True"{disable_keyerror_checked}/>
                 Disable KeyErrors in Actions and Guards
                 <input type="submit" name="fromform" value="update"/>
@@ -224,7 +532,7 @@ template_html_doc = """<html>
         </div>
         <br/>
         <div>
-            <a href="/?reset=True">Click here</a> to start from the beginning.
+            <a href="/?reset=True">Click here</a> to start from the beginning.{checkpoints}
         </div>
         <br/>
         <div>
@@ -235,8 +543,26 @@ template_html_doc = """<html>
 </html>
 """
 
-template_event = "            <button type=\"submit\" name=\"event\" value=\"{event}\">{event_repr}</button>"
+template_event = ("            <button type=\"submit\" name=\"event\" value=\"{event}\"{disabled_style}>"
+                  "{event_repr}</button>")
+template_disabled_event_style = " style=\"color: gray;\" title=\"No guard of this event is true\""
 template_guard = "            <input type=\"checkbox\" name=\"guard\" value=\"{guard}\">{guard_repr}</button>"
+template_layout_note = """
+        <div>
+            <b>Layout took longer than {timeout}s, showing: {layout}</b>
+        </div>"""
+template_checkpoints = """
+            <br/>
+            <a href="/?undo=True">Undo</a> the last event, or go back to: {links}"""
+template_checkpoint_link = "<a href=\"/?goto={ind}\">{label}</a>"
+template_focus_link = "<a href=\"/?focus={state_name}\">{state_name}</a>"
+
+
+def get_checkpoints_html():
+    if len(checkpoints) < 2:
+        return ""
+    return template_checkpoints.format(links=" &gt; ".join(
+        template_checkpoint_link.format(ind=ind, label=label) for ind, label in enumerate(checkpoints.labels[:-1])))
 
 
 def get_font_size_options_html():
@@ -249,12 +575,208 @@ def get_font_size_options_html():
     )
 
 
+def get_depth_options_html():
+    return "\n".join(
+        template_option.format(
+            selected=" selected" if global_config["max_depth"] == depth else "",
+            size="all" if depth is None else depth
+        )
+        for depth in [None] + list(range(1, 9))
+    )
+
+
+def get_focus_html(sc):
+    """
+    Returns links to the focused state and its ancestors, followed by links to its composite children.
+    """
+    focus = global_config["focus"] or sc.root
+    path = [focus] + sc.ancestors_for(focus)
+    focus_path = " &gt; ".join(template_focus_link.format(state_name=state_name) for state_name in reversed(path))
+
+    children = [child for child in sc.children_for(focus) if isinstance(sc.state_for(child), CompositeStateMixin)]
+    if not children:
+        return focus_path, ""
+    return focus_path, ", drill into: {}".format(", ".join(template_focus_link.format(state_name=child)
+                                                           for child in children))
+
+
+class EventButtons(object):
+    """
+    Event buttons of the interactive page for one statechart. Holds an index from every state to the sorted events of
+    its outgoing transitions, and caches the buttons html of every configuration seen so far.
+    """
+    def __init__(self, sc, maxsize=1024):
+        self.statechart = sc
+        self.maxsize = maxsize
+        self.events_for = {
+            state_name: sorted(set(transition.event for transition in sc.transitions_from(state_name)
+                                   if transition.event))
+            for state_name in sc.states
+        }
+        self._html = {}
+        self._enabled_key = None
+        self._enabled = None
+
+    def get_events(self, configuration):
+        return sorted(set(event for state_name in configuration for event in self.events_for[state_name]))
+
+    def get_enabled_events(self, interpreter, generation):
+        """
+        Returns the events that would trigger a transition from the active states of interpreter, given its context.
+        All guards of transitions from the active states are evaluated in a single pass, stopping at the first
+        true guard of every event, and guards that raise count as false. The result is reused until the configuration,
+        the time or the generation changes.
+
+        :param sismic.interpreter.Interpreter interpreter: Interpreter of this statechart.
+        :param int generation: Number that changes whenever the context of interpreter may have changed.
+        :rtype: frozenset
+        """
+        key = (id(interpreter), generation, interpreter.time, frozenset(interpreter.configuration))
+        if key == self._enabled_key:
+            return self._enabled
+
+        evaluator = interpreter._evaluator
+        enabled = set()
+        for state_name in interpreter.configuration:
+            for transition in self.statechart.transitions_from(state_name):
+                if not transition.event or transition.event in enabled:
+                    continue
+                try:
+                    if not transition.guard or evaluator.evaluate_guard(transition, Event(transition.event)):
+                        enabled.add(transition.event)
+                except Exception:
+                    pass
+
+        self._enabled_key, self._enabled = key, frozenset(enabled)
+        return self._enabled
+
+    def get_html(self, configuration, enabled=None):
+        """
+        :param configuration: Active states.
+        :param frozenset enabled: Events to show as enabled, or None to show all events as enabled.
+        """
+        key = (frozenset(configuration), enabled)
+        html = self._html.get(key)
+        if html is None:
+            if len(self._html) >= self.maxsize:
+                self._html.clear()
+            html = self._html[key] = "<br/>\n".join(
+                template_event.format(
+                    event=event,
+                    event_repr=event,
+                    disabled_style="" if enabled is None or event in enabled else template_disabled_event_style
+                )
+                for event in self.get_events(key[0])
+            )
+        return html
+
+
+event_buttons = None  # type: EventButtons
+
+# Incremented whenever the interactive page executes the interpreter, so that cached guard results are discarded.
+interp_generation = 0
+
+
+def get_events_html(interpreter):
+    """
+    Returns the event buttons html of the current configuration of interpreter, with events whose guards are all
+    false grayed out.
+    """
+    global event_buttons
+
+    if event_buttons is None or event_buttons.statechart is not interpreter.statechart:
+        event_buttons = EventButtons(interpreter.statechart)
+    enabled = event_buttons.get_enabled_events(interpreter, interp_generation)
+    return event_buttons.get_html(interpreter.configuration, enabled)
+
+
+def add_metrics_to_flask_app(app, server, get_history_size):
+    """
+    Records the duration of every request of app, and adds a /metrics endpoint in Prometheus text format.
+
+    :param flask.Flask app: App to instrument.
+    :param str server: Value of the server label of the app metrics.
+    :param () -> int get_history_size: Returns the number of entries in the history displayed by app.
+    """
+    from flask import g, request
+
+    @app.before_request
+    def start_request_timer():
+        g.sismic_viz_request_start = default_timer()
+
+    @app.after_request
+    def observe_request_time(response):
+        metrics.observe("sismic_viz_request_seconds", default_timer() - g.sismic_viz_request_start,
+                        server=server, endpoint=request.endpoint or "")
+        return response
+
+    @app.route("/metrics")
+    def get_metrics():
+        metrics.set("sismic_viz_history_size", get_history_size(), server=server)
+        return app.response_class(metrics.to_prometheus(), mimetype="text/plain; version=0.0.4")
+
+
+def parse_event_specs(specs):
+    """
+    Validates a list of events, as accepted by the /events endpoint. Every event is either a name, or an object with
+    a "name", and optional "parameters" and "delay" in seconds. The delay is the time to advance the clock by before
+    sending the event.
+
+    :param list specs: Decoded JSON list of events.
+    :return: List of (name, parameters, delay).
+    :raises ValueError: If specs is not a valid list of events.
+    """
+    if not isinstance(specs, list):
+        raise ValueError("expected a list of events")
+
+    events = []
+    for ind, spec in enumerate(specs):
+        if not isinstance(spec, dict):
+            spec = {"name": spec}
+        name, parameters, delay = spec.get("name"), spec.get("parameters") or {}, spec.get("delay") or 0
+        if not name or not isinstance(name, str):
+            raise ValueError("event {}: expected a name".format(ind))
+        if not isinstance(parameters, dict):
+            raise ValueError("event {}: expected parameters to be an object".format(ind))
+        if not isinstance(delay, (int, float)) or delay < 0:
+            raise ValueError("event {}: expected delay to be a non-negative number".format(ind))
+        events.append((name, parameters, delay))
+    return events
+
+
+def execute_events(interpreter, events, history=None):
+    """
+    Sends events to an interpreter one by one, each after advancing its simulated clock by the event's delay, and
+    executes the interpreter after each event.
+
+    :param sismic.interpreter.Interpreter interpreter: Interpreter with a SimulatedClock, if any event has a delay.
+    :param list events: List of (name, parameters, delay), as returned by parse_event_specs.
+    :param list history: List to append history entries to, in the format of the interactive page.
+    :return: The executed macro steps.
+    :rtype: list
+    """
+    macro_steps = []
+    for name, parameters, delay in events:
+        if delay:
+            interpreter.clock.time += delay
+        if history is not None:
+            history.append("<b>Triggered Event: <u>\"{}\"</u></b>".format(name))
+        for macro_step in interpreter.queue(Event(name, **parameters)).execute():
+            macro_steps.append(macro_step)
+            if history is not None:
+                history.extend(macro_step.steps)
+    return macro_steps
+
+
 def get_flask_app():
+    from flask import Flask, send_file, request, jsonify
+
     app = Flask(__name__)
+    add_metrics_to_flask_app(app, "interactive", lambda: len(global_config["history"]))
 
     @app.route('/', methods=['GET'])
     def display_interactive_statechart():
-        global global_config
+        global global_config, interp_generation, interp
 
         if request.args.get("reset", False, bool):
             just_created = True
@@ -266,35 +788,68 @@ def get_flask_app():
             global_config["include_guards"] = request.args.get("include_guards", False, bool)
             global_config["include_actions"] = request.args.get("include_actions", False, bool)
             global_config["disable_keyerror"] = request.args.get("disable_keyerror", False, bool)
+            max_depth = request.args.get("max_depth", "all", str)
+            global_config["max_depth"] = int(max_depth) if max_depth.isdigit() else None
+            global_config["collapse_inactive"] = request.args.get("collapse_inactive", False, bool)
+            global_config["lean_labels"] = request.args.get("lean_labels", False, bool)
+
+        if "focus" in request.args:
+            focus = request.args.get("focus", "", str)
+            global_config["focus"] = focus if focus in interp.statechart.states and \
+                focus != interp.statechart.root else None
+
+        if global_config["prerender"]:
+            start_prerendering(interp.statechart, global_config)
+
+        if just_created:
+            interp_generation += 1
+            reset_interp()
+            global_config["history"].append("<b>Reset</b>")
+            checkpoints.clear()
+
+        if not len(checkpoints):
+            checkpoints.push(interp, "start", len(global_config["history"]))
+
+        goto = request.args.get("goto", None, int)
+        if request.args.get("undo", False, bool):
+            goto = len(checkpoints) - 2
+        if goto is not None and 0 <= goto < len(checkpoints) - 1:
+            interp_generation += 1
+            interp = checkpoints.restore(goto)
+            del global_config["history"][checkpoints.get_history_size(goto):]
 
         if global_config["disable_keyerror"]:
             disable_keyerror_in_actions()
         else:
             enable_keyerror_in_actions()
 
-        if just_created:
-            interp.execute()
-
         event = request.args.get('event', '', str)
         if event:
+            interp_generation += 1
             global_config["history"].append("<b>Triggered Event: <u>\"{}\"</u></b>".format(event))
-            for macro_step in interp.queue(Event(event)).execute():
-                global_config["history"].extend(macro_step.steps)
+            try:
+                for macro_step in interp.queue(Event(event)).execute():
+                    global_config["history"].extend(macro_step.steps)
+            finally:
+                checkpoints.push(interp, event, len(global_config["history"]))
 
-        create_image(interp.statechart, interp.configuration, global_config, imagefile_path)
+        layout_level = create_image(interp.statechart, interp.configuration, global_config, imagefile_path)
+        focus_path, focus_children = get_focus_html(interp.statechart)
 
         return template_html_doc.format(
             timestamp=time.time(),
+            layout_note=get_layout_note_html(layout_level, global_config["layout_timeout"]),
+            focus_path=focus_path,
+            focus_children=focus_children,
+            depth_options=get_depth_options_html(),
             include_guards_checked=" checked" if global_config["include_guards"] else "",
             include_actions_checked=" checked" if global_config["include_actions"] else "",
             disable_keyerror_checked=" checked" if global_config["disable_keyerror"] else "",
+            collapse_inactive_checked=" checked" if global_config["collapse_inactive"] else "",
+            lean_labels_checked=" checked" if global_config["lean_labels"] else "",
             font_options=get_font_size_options_html(),
-            events="<br/>\n".join(sorted(set(
-                template_event.format(event=transition.event, event_repr=transition.event)
-                for state in interp.configuration
-                for transition in interp.statechart.transitions_from(state)
-                if transition.event
-            ))),
+            events=get_events_html(interp),
+            checkpoints=get_checkpoints_html(),
             last_output="<br/>\n".join(pprint.pformat(global_config["history"][::-1]).splitlines())
         )
 
@@ -302,269 +857,1671 @@ def get_flask_app():
     def get_statechart_graph():
         return send_file(imagefile_path, mimetype="image/svg+xml")
 
-    return app
+    @app.route('/events', methods=['POST'])
+    def post_events():
+        """
+        Executes a JSON list of events, see parse_event_specs, and renders only the final configuration.
+        """
+        global interp_generation
 
+        data = request.get_json(silent=True)
+        try:
+            events = parse_event_specs(data.get("events") if isinstance(data, dict) else data)
+        except ValueError as e:
+            return jsonify(error=str(e)), 400
+        from sismic.clock import SimulatedClock
 
-def create_image(statechart, in_states, configuration, imagepath):
-    if configuration["file_type"] == "dot":
-        with tempfile.NamedTemporaryFile() as f:
-            if configuration["file_type"] == "dot":
-                output = export_to_dot(statechart,
-                                       edge_fontsize=configuration["edge_fontsize"],
-                                       include_guards=configuration["include_guards"],
-                                       include_actions=configuration["include_actions"],
-                                       configuration=in_states)
-                f.write(output)
-                f.flush()
-                open("/tmp/hello.dot", "wb").write(output)
-                os.system("dot -Tsvg {inpath} -o {outpath}".format(inpath=f.name, outpath=imagepath))
-    else:
-        dirname = tempfile.mkdtemp()
+        if any(delay for _, _, delay in events) and not isinstance(interp.clock, SimulatedClock):
+            return jsonify(error="delays require an interpreter with a simulated clock"), 400
+
+        if global_config["disable_keyerror"]:
+            disable_keyerror_in_actions()
+        else:
+            enable_keyerror_in_actions()
+
+        if not len(checkpoints):
+            checkpoints.push(interp, "start", len(global_config["history"]))
+
+        interp_generation += 1
+        history = []
         try:
-            output = export_to_plantuml(statechart)
-            fname = os.path.join(dirname, "graph.puml")
-            with open(fname, "wb") as f:
-                f.write(output)
-                f.flush()
-            os.system("plantuml {inpath} -o {outpath} -tsvg".format(inpath=fname, outpath=dirname))
-            open(imagefile_path, "wb").write(open(os.path.join(dirname, "graph.svg"), "rb").read())
+            execute_events(interp, events, history)
         finally:
-            shutil.rmtree(dirname)
+            global_config["history"].extend(history)
+            checkpoints.push(interp, "{} events".format(len(events)), len(global_config["history"]))
+            layout_level = create_image(interp.statechart, interp.configuration, global_config, imagefile_path)
 
+        return jsonify(configuration=interp.configuration, time=interp.time, executed=len(events),
+                       layout_level=layout_level)
 
-template_bound_doc = """
-<html>
-    <head>{refresh_head}    </head>
-    <body>
-        clock: <div id="clock">{clock_time:10.3f}{stopped}</div><br/>{states}<br/><a href=\"/shutdown?{timestamp}\">shutdown server</a>
-        <br/>
-        <img src=\"statechart.svg?{timestamp}\" id=\"statechart\" style=\"max-width:100%; height:auto;\"/>
-        <br/>
-        <div id="history">
-{history}
-        </div>
-    </body>
-</html>
-"""
+    return app
 
 
-# template_refresh_head = "<meta http-equiv=\"refresh\" content=\"1; URL=/\">"
-template_refresh_head = """
-        <script src="https://ajax.googleapis.com/ajax/libs/jquery/3.2.1/jquery.min.js"></script>
-        <script>
-            setInterval(function() {
-                var myImageElement = document.getElementById('statechart');
-                myImageElement.src = 'statechart.svg?rand=' + Math.random();
-                $('#clock').load("clock?rand=" + Math.random());
-                $('#history').load("history?rand=" + Math.random());
-            }, 1000);
-        </script>
-"""
+class RenderCache(object):
+    """
+    In-memory LRU cache of rendered images, keyed by a hash of the source text and the output file type.
+    """
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
 
+    @staticmethod
+    def _key(source, file_type):
+        return hashlib.sha1(source.encode("utf-8")).hexdigest(), file_type
 
-template_bound_history = "clock: {clock_time:10.3f}, events: {events}, in states: {states}"
+    def get(self, source, file_type):
+        key = self._key(source, file_type)
+        with self._lock:
+            data = self._entries.pop(key, None)
+            if data is not None:
+                self._entries[key] = data
+            return data
 
+    def put(self, source, file_type, data):
+        key = self._key(source, file_type)
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = data
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
 
-def shrink_list(l):
-    if l:
-        ll = [[l[0], 1]]
-        for elem in l[1:]:
-            if elem == ll[-1][0]:
-                ll[-1][1] += 1
-            else:
-                ll.append([elem, 1])
-        return ", ".join(elem if times == 1 else "{} x {}".format(elem, times) for elem, times in ll)
-    else:
-        return ""
 
+render_cache = RenderCache()
 
-@contextmanager
-def server_to_bind(statechart, open_browser=True, port=5000, time_factor=1., logging=True):
+
+class DiskRenderCache(object):
     """
-    Starts a background flask server that displays the statechart, and returns a context manager that yields a callback
-    to attach to an interpreter. The displayed statechart is continuously updated to show the interpreter configuartion,
-    as received through the callback calls.
+    On-disk cache of rendered images, shared by all processes that use the same cache_dir. Entries are files in
+    cache_dir/renders, named by a sha256 of the source text and the output file type, and written atomically.
+    Reading an entry updates its modification time, and when the entries exceed maxsize bytes the least recently
+    used ones are removed, under a lock file so that processes don't evict at the same time.
 
-    :param sismic.model.Statechart statechart: Statechart to display.
-    :param bool open_browser: Whether to open a browser for you.
-    :param int port: Port to use for server.
-    :param float time_factor: Divide time clock by this number.
-    :return: Callback for attaching to interpreter.
-    :rtype: (sismic.model.MetaEvent) -> None
+    An estimate of the total size, from the last scan of the directory plus the sizes written since, is kept in
+    cache_dir/renders/.size and shared by all processes. The directory is scanned again only when the estimate
+    exceeds maxsize, or after rescan_every writes to correct the estimate for entries replaced or removed since.
+
+    :param int maxsize: Maximal total size of the entries, in bytes.
+    :param int rescan_every: Number of writes between scans of the directory.
     """
-    configuration = set()
-    last_printed_configuration = set()
-    history = []
-    events = []
-    clock_time = [0]
+    # Seconds after which a temporary file is considered left by a writer that crashed.
+    stale_temp_age = 3600.
+
+    def __init__(self, maxsize=256 * 1024 * 1024, rescan_every=100):
+        self.maxsize = maxsize
+        self.rescan_every = rescan_every
+        self._lock = threading.Lock()
+
+    @property
+    def dirname(self):
+        return None if cache_dir is None else os.path.join(cache_dir, "renders")
+
+    @staticmethod
+    def _key(source, file_type):
+        key = hashlib.sha256(source.encode("utf-8"))
+        key.update(b"\0" + file_type.encode("utf-8"))
+        return key.hexdigest()
+
+    def get(self, source, file_type):
+        dirname = self.dirname
+        if dirname is None:
+            return None
+
+        path = os.path.join(dirname, self._key(source, file_type))
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path, None)
+        except EnvironmentError:
+            return None
+        return data
+
+    def put(self, source, file_type, data):
+        dirname = self.dirname
+        if dirname is None:
+            return
 
-    def callback(metaevent):
+        try:
+            if not os.path.isdir(dirname):
+                os.makedirs(dirname)
+            with tempfile.NamedTemporaryFile(dir=dirname, prefix=".", delete=False) as f:
+                f.write(data)
+            os.replace(f.name, os.path.join(dirname, self._key(source, file_type)))
+            self._add_size(dirname, len(data))
+        except EnvironmentError as e:
+            print("failed to write render cache entry: {}".format(e), file=sys.stderr)
+
+    @contextmanager
+    def _locked(self, dirname):
+        with self._lock:
+            try:
+                import fcntl
+            except ImportError:
+                yield
+                return
+
+            with open(os.path.join(dirname, ".lock"), "a") as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _add_size(self, dirname, size):
         """
-        :type metaevent: sismic.model.MetaEvent
+        Adds the size of a new entry to the estimate in .size, and evicts entries when needed.
         """
-        if metaevent.name == "state entered":
-            configuration.add(metaevent.state)
-        elif metaevent.name == "state exited":
-            configuration.remove(metaevent.state)
-        elif metaevent.name == "event consumed" and metaevent.event.name:
-            events.append(metaevent.event.name)
-        elif metaevent.name == "step started":
-            clock_time[0] = metaevent.time
-            if configuration != last_printed_configuration:
-                history.append(template_bound_history.format(clock_time=clock_time[0] / time_factor,
-                                                             events=shrink_list(events),
-                                                             states=", ".join(configuration)))
-                last_printed_configuration.clear()
-                last_printed_configuration.update(configuration)
-                events[:] = []
+        path = os.path.join(dirname, ".size")
+        with self._locked(dirname):
+            try:
+                with open(path) as f:
+                    total, puts = [int(value) for value in f.read().split()]
+            except (EnvironmentError, ValueError):
+                total = None
 
-    def background_server(stop_event):
+            if total is None or total + size > self.maxsize or puts + 1 >= self.rescan_every:
+                total, puts = self._evict(dirname), 0
+            else:
+                total, puts = total + size, puts + 1
+
+            with open(path, "w") as f:
+                f.write("{} {}".format(total, puts))
+
+    def _evict(self, dirname):
         """
-        :type stop_event: threading.Event
+        Removes least recently used entries until they fit in maxsize, and temporary files of crashed writers. Must
+        be called with the lock held.
+
+        :return: Total size of the remaining entries.
         """
-        global imagefile_path
+        entries = []
+        now = time.time()
+        for name in os.listdir(dirname):
+            path = os.path.join(dirname, name)
+            try:
+                file_stat = os.stat(path)
+                if name.startswith("."):
+                    if name not in (".lock", ".size") and now - file_stat.st_mtime > self.stale_temp_age:
+                        os.remove(path)
+                    continue
+            except OSError:
+                continue
+            entries.append((file_stat.st_mtime, file_stat.st_size, name))
 
-        with tempfile.NamedTemporaryFile() as imagefile:
-            imagefile_path = imagefile.name
-            app = Flask(__name__)
-            import logging as logging_
-            log = logging_.getLogger('werkzeug')
-            log.disabled = not logging
-
-            @app.route("/")
-            def index():
-                return get_page()
-
-            def get_page():
-                create_image(statechart, configuration, {
-                    "file_type": "dot",
-                    "edge_fontsize": 14,
-                    "include_guards": False,
-                    "include_actions": False,
-                }, imagefile_path)
-                return template_bound_doc.format(refresh_head="" if stop_event.is_set() else template_refresh_head,
-                                                 clock_time=clock_time[0] / time_factor,
-                                                 stopped=" STOPPED" if stop_event.is_set() else "",
-                                                 states=", ".join(configuration),
-                                                 timestamp=time.time(),
-                                                 history="<br/>\n".join(history[::-1]))
-
-            def shutdown_server():
-                func = request.environ.get('werkzeug.server.shutdown')
-                if func is None:
-                    raise RuntimeError('Not running with the Werkzeug Server')
-                func()
-
-            @app.route('/statechart.svg')
-            def get_statechart_graph():
-                create_image(statechart, configuration, {
-                    "file_type": "dot",
-                    "edge_fontsize": 14,
-                    "include_guards": False,
-                    "include_actions": False,
-                }, imagefile_path)
-                return send_file(imagefile_path, mimetype="image/svg+xml")
-
-            @app.route("/clock")
-            def get_clock():
-                return "{clock_time:10.3f}{stopped}".format(
-                    clock_time=clock_time[0] / time_factor,
-                    stopped=" STOPPED" if stop_event.is_set() else ""
-                )
+        total = sum(size for _, size, _ in entries)
+        if total <= self.maxsize:
+            return total
 
-            @app.route("/history")
-            def get_history():
-                return "<br/>\n".join(history[::-1])
+        # Evict down to 80% of maxsize, so that the following puts don't evict again right away.
+        for _, size, name in sorted(entries):
+            if total <= self.maxsize * .8:
+                break
+            try:
+                os.remove(os.path.join(dirname, name))
+            except OSError:
+                continue
+            total -= size
+        return total
 
-            @app.route('/shutdown')
-            def shutdown():
-                shutdown_server()
-                return get_page()
 
-            if open_browser:
-                webbrowser.open_new("http://127.0.0.1:{port}".format(port=port))
-            app.run(host='0.0.0.0', port=port, threaded=False)
+disk_render_cache = DiskRenderCache()
 
-    import threading
-    _stop_event = threading.Event()
-    threading.Thread(target=background_server, args=(_stop_event,)).start()
+# Seconds a single dot process may run before it is killed.
+render_timeout = 60.
 
-    try:
-        yield callback
-    finally:
-        # _stop_event.set()
-        print("exitting sismic viz server")
 
+class RenderError(RuntimeError):
+    """
+    Raised when graphviz can't be run, fails, or times out. stderr holds its error output, if any.
+    """
+    def __init__(self, message, stderr=""):
+        RuntimeError.__init__(self, message)
+        self.stderr = stderr
 
-def create_interp():
-    global interp, yaml_filepath
 
-    daemon = import_from_yaml(filepath=yaml_filepath)
-    interp = Interpreter(daemon)
-    return interp
+class RenderTimeout(RenderError):
+    """
+    Raised when a render is killed because it exceeded its timeout.
+    """
 
 
-class CallMe(object):
-    def __call__(self, *args, **kwargs):
-        return self
+def get_cached_render(source, file_type):
+    """
+    Returns the render of source from render_cache or else from disk_render_cache, or None and counts a miss.
+    """
+    data = render_cache.get(source, file_type)
+    if data is not None:
+        metrics.inc("sismic_viz_render_cache_hits_total")
+        return data
 
-    def __getattribute__(self, name):
-        return self
+    data = disk_render_cache.get(source, file_type)
+    if data is not None:
+        metrics.inc("sismic_viz_disk_cache_hits_total")
+        render_cache.put(source, file_type, data)
+        return data
 
+    metrics.inc("sismic_viz_render_cache_misses_total")
+    return None
 
-class NoKeyErrorDict(dict):
-    def __init__(self, globals_, locals_):
-        dict.__init__(self, globals_, **locals_)
-        self.globals_ = globals_
-        self.locals_ = locals_
 
-    def __setitem__(self, name, value):
-        self.locals_[name] = value
+def put_cached_render(source, file_type, data):
+    render_cache.put(source, file_type, data)
+    disk_render_cache.put(source, file_type, data)
 
-    def __getitem__(self, name):
-        try:
-            return self.locals_[name]
-        except KeyError:
-            try:
-                return self.globals_[name]
-            except KeyError:
-                return CallMe()
 
+def render_dot(dot, file_type="svg", timeout=None, args=()):
+    """
+    Lays out dot source with graphviz and returns the rendered image as bytes. The source is piped to dot's stdin
+    and the image read from its stdout. Renders of identical source and arguments are served from render_cache, or
+    from disk_render_cache when another run or process rendered them.
+
+    :param float timeout: Seconds before dot is killed. Default: render_timeout.
+    :param args: Additional command line arguments of dot.
+    :raises RenderError: If dot is not installed or fails.
+    :raises RenderTimeout: If dot times out.
+    """
+    cache_type = " ".join([file_type] + list(args))
+    data = get_cached_render(dot, cache_type)
+    if data is not None:
+        return data
 
-def disable_keyerror_in_actions():
-    from future.utils import raise_from
-    from sismic.exceptions import CodeEvaluationError
-    from types import MethodType
+    timeout = render_timeout if timeout is None else timeout
+    with metrics.timer("sismic_viz_phase_seconds", phase="layout"):
+        try:
+            process = subprocess.Popen(["dot", "-T" + file_type] + list(args), stdin=subprocess.PIPE,
+                                       stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        except OSError as e:
+            raise RenderError("can't run dot: {}".format(e))
+        try:
+            data, stderr = process.communicate(dot.encode("utf-8"), timeout=timeout)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            _, stderr = process.communicate()
+            raise RenderTimeout("dot timed out after {}s".format(timeout), stderr.decode("utf-8", "replace"))
 
-    if not hasattr(interp._evaluator, "old_execute_code"):
-        interp._evaluator.old_execute_code = interp._evaluator._execute_code
+    if process.returncode != 0:
+        stderr = stderr.decode("utf-8", "replace")
+        raise RenderError("dot exited with status {}: {}".format(process.returncode, stderr.strip()), stderr)
 
-        def new_execute_code(self, code, **kwargs):
-            additional_context = kwargs.get("additional_context")
+    put_cached_render(dot, cache_type, data)
+    return data
 
-            if code is None:
-                return []
 
-            compiled_code = self._executable_code.get(code, None)
-            if compiled_code is None:
-                compiled_code = self._executable_code.setdefault(code, compile(code, '<string>', 'exec'))
+class PlantUMLWorker(object):
+    """
+    Long running "plantuml -pipe" process that renders diagrams to svg, so that the JVM starts once rather than for
+    every image. The process is started on first use, and killed and started again after a failure or a timeout.
 
-            exposed_context = {
-                'active': self._time_provider.active,
-                'time': self._time_provider.time,
-                'send': self._event_provider.send,
-                'notify': self._event_provider.notify,
-                'setdefault': self._setdefault,
-            }
-            exposed_context.update(additional_context if additional_context is not None else {})
+    :param list command: Command that runs plantuml.
+    :param float timeout: Seconds a single render may take.
+    """
+    delimiter = "__sismic_viz_end_of_diagram__"
 
-            try:
-                exec (compiled_code, NoKeyErrorDict(exposed_context, self._context))  # type: ignore
-                return self._event_provider.pending
-            except Exception as e:
-                raise_from(CodeEvaluationError('"{}" occurred while executing "{}"'.format(e, code)), e)
+    def __init__(self, command=("plantuml",), timeout=30.):
+        self.command = list(command)
+        self.timeout = timeout
+        self._process = None
+        self._lines = None
+        self._lock = threading.Lock()
 
-        interp._evaluator._execute_code = MethodType(new_execute_code, interp._evaluator)
+    def _start(self):
+        try:
+            self._process = subprocess.Popen(
+                self.command + ["-pipe", "-tsvg", "-charset", "UTF-8", "-pipedelimitor", self.delimiter],
+                stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        except OSError as e:
+            self._process = None
+            raise RenderError("can't run plantuml: {}".format(e))
+
+        # A reader thread moves output lines to a queue, so that reads can time out. None marks the end of output.
+        self._lines = queue.Queue()
+
+        def read_lines(stdout, lines):
+            for line in iter(stdout.readline, b""):
+                lines.put(line)
+            lines.put(None)
+
+        reader = threading.Thread(target=read_lines, args=(self._process.stdout, self._lines))
+        reader.daemon = True
+        reader.start()
+
+    def stop(self):
+        with self._lock:
+            self._stop()
+
+    def _stop(self):
+        if self._process is not None:
+            try:
+                self._process.kill()
+                self._process.wait()
+            except OSError:
+                pass
+            self._process = None
+
+    def _render_once(self, source):
+        if self._process is None or self._process.poll() is not None:
+            self._start()
+
+        self._process.stdin.write(source.encode("utf-8") + b"\n")
+        self._process.stdin.flush()
+
+        deadline = default_timer() + self.timeout
+        chunks = []
+        delimiter = self.delimiter.encode("utf-8")
+        while True:
+            try:
+                line = self._lines.get(timeout=max(deadline - default_timer(), 0))
+            except queue.Empty:
+                self._stop()
+                raise RenderError("plantuml timed out")
+            if line is None:
+                raise EOFError("plantuml exited")
+            if line.rstrip().endswith(delimiter):
+                chunks.append(line.rstrip()[:-len(delimiter)])
+                return b"".join(chunks)
+            chunks.append(line)
+
+    def render(self, source):
+        """
+        Renders plantuml source to svg.
+
+        :rtype: bytes
+        :raises RenderError: If plantuml can't be run, exits twice in a row, or times out.
+        """
+        with self._lock:
+            for attempt in range(2):
+                try:
+                    return self._render_once(source)
+                except (IOError, EOFError) as e:
+                    # The worker died, maybe between renders. Start a new one, and retry once.
+                    self._stop()
+                    if attempt:
+                        raise RenderError("plantuml failed: {}".format(e))
+
+
+plantuml_worker = PlantUMLWorker()
+atexit.register(plantuml_worker.stop)
+
+
+def render_plantuml(source):
+    """
+    Same as render_dot, for plantuml source rendered to svg by plantuml_worker.
+    """
+    data = get_cached_render(source, "puml-svg")
+    if data is not None:
+        return data
+
+    with metrics.timer("sismic_viz_phase_seconds", phase="layout"):
+        data = plantuml_worker.render(source)
+    put_cached_render(source, "puml-svg", data)
+    return data
+
+
+def copy_output_mode(temp_path, path):
+    """
+    Gives a temporary file that is about to be renamed to path the permissions of path, or if there is no such file,
+    the permissions that open() gives to new files, rather than the owner-only permissions of temporary files.
+    """
+    try:
+        mode = stat.S_IMODE(os.stat(path).st_mode)
+    except OSError:
+        umask = os.umask(0)
+        os.umask(umask)
+        mode = 0o666 & ~umask
+    os.chmod(temp_path, mode)
+
+
+@contextmanager
+def open_output_file(path, mode="w"):
+    """
+    Same as open(path, mode), except that a path of "-" yields the standard output.
+    """
+    if path == "-":
+        yield sys.stdout.buffer if "b" in mode else sys.stdout
+        sys.stdout.flush()
+    else:
+        with open(path, mode) as f:
+            yield f
+
+
+template_stitched_svg = """<?xml version="1.0" encoding="UTF-8" standalone="no"?>
+<svg width="{width}pt" height="{height}pt" viewBox="0 0 {width} {height}" xmlns="http://www.w3.org/2000/svg" \
+xmlns:xlink="http://www.w3.org/1999/xlink">
+<rect x="1" y="1" width="{frame_width}" height="{frame_height}" rx="8" fill="white" stroke="black" \
+stroke-dasharray="5,2"/>
+<text text-anchor="middle" x="{center}" y="{title_y}" font-family="Times,serif" font-size="14" \
+font-weight="bold">{name}</text>{regions}
+</svg>
+"""
+
+template_stitched_region = """
+<svg x="{x}" y="{y}" width="{width}" height="{height}"{attributes}"""
+
+template_stitched_separator = """
+<line x1="{x}" y1="{y1}" x2="{x}" y2="{y2}" stroke="black" stroke-dasharray="5,2"/>"""
+
+region_margin = 12
+region_title_height = 24
+
+
+def can_split_regions(sc, focus=None):
+    return focus is None and isinstance(sc.state_for(sc.root), OrthogonalState) and \
+        len(sc.children_for(sc.root)) > 1
+
+
+def stitch_svgs(name, svgs):
+    """
+    Composes svg documents made by dot into one svg document, placing them side by side under a title.
+
+    :param str name: Title of the composed document.
+    :param list svgs: Svg documents, as bytes.
+    :rtype: bytes
+    """
+    regions = []
+    separators = []
+    x = region_margin
+    height = 0
+    for ind, svg in enumerate(svgs):
+        svg = svg.decode("utf-8")
+        match = re.search(r"<svg\b([^>]*)>", svg)
+        attributes = match.group(1)
+        width_pt = float(re.search(r'\bwidth="([\d.]+)pt"', attributes).group(1))
+        height_pt = float(re.search(r'\bheight="([\d.]+)pt"', attributes).group(1))
+        attributes = re.sub(r'\s(width|height|x|y)="[^"]*"', "", attributes)
+
+        # Ids made by dot, like node1, repeat in every region. Ids of export_to_dot(element_ids=True) don't, and are
+        # kept for highlight_svg.
+        body = re.sub(r'\bid="(?!state_|transition_)', 'id="region{}_'.format(ind), svg[match.end():])
+        regions.append(template_stitched_region.format(x=x, y=region_title_height, width=width_pt,
+                                                       height=height_pt, attributes=attributes) + ">" + body)
+        if ind:
+            separators.append(x - region_margin / 2.)
+        x += width_pt + region_margin
+        height = max(height, height_pt)
+
+    width = max(x, 2 * region_margin)
+    height += region_title_height + region_margin
+    regions.extend(template_stitched_separator.format(x=separator, y1=region_title_height, y2=height - region_margin)
+                   for separator in separators)
+
+    return template_stitched_svg.format(width=width, height=height, frame_width=width - 2, frame_height=height - 2,
+                                        center=width / 2., title_y=region_title_height - 8, name=name,
+                                        regions="".join(regions)).encode("utf-8")
+
+
+def render_regions(sc, jobs=None, timeout=None, dot_args=(), **dot_options):
+    """
+    Renders a statechart whose root state is orthogonal to svg, laying out each region separately, in parallel, and
+    composing the results. Transitions between regions end at boundary ports. Layouts of regions whose dot source
+    did not change come from render_cache.
+
+    :param sismic.model.Statechart sc: Statechart with an orthogonal root state.
+    :param int jobs: Maximal number of dot processes running together. Default: number of CPUs.
+    :param float timeout: Seconds before every dot process is killed. See render_dot.
+    :param dot_args: Additional command line arguments of dot.
+    :param dot_options: Keyword arguments of export_to_dot. Focus is ignored.
+    :rtype: bytes
+    """
+    dots = [export_to_dot(sc, **dict(dot_options, focus=region)) for region in sc.children_for(sc.root)]
+
+    pool = ThreadPool(min(jobs or multiprocessing.cpu_count(), len(dots)))
+    try:
+        svgs = pool.map(lambda dot: render_dot(dot, "svg", timeout, dot_args), dots, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+
+    return stitch_svgs(sc.name, svgs)
+
+
+def render_statechart(sc, file_type="svg", split_regions=False, jobs=None, **dot_options):
+    """
+    Renders a statechart with dot and returns the image as bytes.
+
+    :param sismic.model.Statechart sc: Statechart to render.
+    :param str file_type: Any format dot can produce.
+    :param bool split_regions: For svg output of a statechart whose root state is orthogonal, lay out each region
+        separately. See render_regions.
+    :param int jobs: Maximal number of dot processes running together, with split_regions.
+    :param dot_options: Keyword arguments of export_to_dot.
+    :rtype: bytes
+    """
+    if split_regions and file_type == "svg" and can_split_regions(sc, dot_options.get("focus")):
+        return render_regions(sc, jobs=jobs, **dot_options)
+    return render_dot(export_to_dot(sc, **dot_options), file_type)
+
+
+class DebugDumper(object):
+    """
+    Writes debug copies of documents to files, on a background thread, so that the caller does no I/O. Files are
+    named by the hash of their content, so identical documents are written once, and concurrent processes never
+    write different content to the same file. Pending writes are flushed at exit.
+    """
+    def __init__(self):
+        self._queue = None
+        self._lock = threading.Lock()
+
+    def _write_all(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            path, text = item
+            try:
+                if not os.path.exists(path):
+                    dirname = os.path.dirname(path)
+                    if not os.path.isdir(dirname):
+                        os.makedirs(dirname)
+                    with tempfile.NamedTemporaryFile(mode="w", dir=dirname, delete=False) as f:
+                        f.write(text)
+                    os.replace(f.name, path)
+            except EnvironmentError as e:
+                print("failed to write debug copy {}: {}".format(path, e), file=sys.stderr)
+
+    def dump(self, dirname, text, extension="dot"):
+        """
+        Queues text to be written to dirname/<sha1 of text>.<extension>.
+        """
+        with self._lock:
+            if self._queue is None:
+                self._queue = queue.Queue()
+                writer = threading.Thread(target=self._write_all)
+                writer.daemon = True
+                writer.start()
+                atexit.register(self.close, writer)
+        path = os.path.join(dirname, "{}.{}".format(hashlib.sha1(text.encode("utf-8")).hexdigest(), extension))
+        self._queue.put((path, text))
+
+    def close(self, writer):
+        self._queue.put(None)
+        writer.join()
+
+
+debug_dumper = DebugDumper()
+
+
+# Cheaper ways to lay out a statechart, tried in order when dot exceeds the layout timeout. Each is a name, options
+# of export_to_dot, and dot command line arguments.
+layout_fallbacks = [
+    ("full", {}, ()),
+    ("labels in tooltips", {"lean_labels": True}, ()),
+    ("inactive states collapsed", {"lean_labels": True, "collapse_inactive": True}, ()),
+    ("fast layout", {"lean_labels": True, "collapse_inactive": True},
+     ("-Gsplines=line", "-Gnslimit=1", "-Gnslimit1=1", "-Gmclimit=0.1", "-Gsearchsize=10")),
+]
+
+template_layout_timeout_svg = """<?xml version="1.0" encoding="UTF-8" standalone="no"?>
+<svg width="400pt" height="40pt" viewBox="0 0 400 40" xmlns="http://www.w3.org/2000/svg">
+<text x="10" y="25" font-family="Times,serif" font-size="14">Layout of {name} exceeded {timeout}s.</text>
+</svg>
+"""
+
+
+# Index in layout_fallbacks of the first layout to try for a statechart and display options, keyed by the id of the
+# statechart and the options other than the configuration, see render_with_fallbacks.
+layout_levels = RenderCache(maxsize=1024)
+
+
+def render_with_fallbacks(statechart, dot_options, split_regions=False, timeout=None):
+    """
+    Renders a statechart to svg, trying the layouts of layout_fallbacks in order until one finishes within timeout.
+    If none does, returns an svg that says so.
+
+    Every layout but the last may use half of the time that is left, and the layout that finished is remembered in
+    layout_levels, so that the next render of the statechart with the same options, in any configuration, starts
+    from it rather than timing out again.
+
+    :param dict dot_options: Keyword arguments of export_to_dot.
+    :param bool split_regions: See render_statechart.
+    :param float timeout: Seconds all layouts together may take, or None for a single attempt with render_timeout.
+    :return: The svg, and the index in layout_fallbacks of the layout used, or len(layout_fallbacks) if none was.
+    :rtype: (bytes, int)
+    """
+    split_regions = split_regions and can_split_regions(statechart, dot_options.get("focus"))
+    fallbacks = layout_fallbacks if timeout is not None else layout_fallbacks[:1]
+
+    key = None
+    start = 0
+    if timeout is not None:
+        key = repr((id(statechart), sorted((name, value) for name, value in dot_options.items()
+                                           if name not in ("configuration", "collapse_inactive"))))
+        start = layout_levels.get(key, "split" if split_regions else "single") or 0
+
+    deadline = None if timeout is None else default_timer() + timeout
+    previous = None
+    for level in range(start, len(fallbacks)):
+        name, overrides, dot_args = fallbacks[level]
+        options = dict(dot_options, **overrides)
+        if options == previous and not dot_args:
+            continue
+        previous = options
+
+        attempt_timeout = None
+        if deadline is not None:
+            attempt_timeout = deadline - default_timer()
+            if attempt_timeout <= 0:
+                break
+            if level < len(fallbacks) - 1:
+                attempt_timeout /= 2.
+        try:
+            if split_regions:
+                data = render_regions(statechart, timeout=attempt_timeout, dot_args=dot_args, **options)
+            else:
+                data = render_dot(export_to_dot(statechart, **options), "svg", attempt_timeout, dot_args)
+        except RenderTimeout:
+            continue
+        if key is not None and level != start:
+            layout_levels.put(key, "split" if split_regions else "single", level)
+        if level:
+            metrics.inc("sismic_viz_layout_fallbacks_total", fallback=name)
+        return data, level
+
+    if key is not None:
+        layout_levels.put(key, "split" if split_regions else "single", len(fallbacks) - 1)
+    metrics.inc("sismic_viz_layout_fallbacks_total", fallback="none")
+    return template_layout_timeout_svg.format(name=statechart.name, timeout=timeout).encode("utf-8"), len(fallbacks)
+
+
+def get_dot_options(configuration, in_states):
+    """
+    :param dict configuration: Display options, like global_config.
+    :param in_states: Names of active states.
+    :return: Keyword arguments of export_to_dot.
+    :rtype: dict
+    """
+    return {
+        "edge_fontsize": configuration["edge_fontsize"],
+        "include_guards": configuration["include_guards"],
+        "include_actions": configuration["include_actions"],
+        "configuration": in_states,
+        "focus": configuration.get("focus"),
+        "max_depth": configuration.get("max_depth"),
+        "collapse_inactive": configuration.get("collapse_inactive", False),
+        "lean_labels": configuration.get("lean_labels", False),
+    }
+
+
+def create_image(statechart, in_states, configuration, imagepath):
+    """
+    Renders a statechart with its active states highlighted to imagepath, in svg.
+
+    :param dict configuration: Display options, like global_config.
+    :return: Index in layout_fallbacks of the layout used, see render_with_fallbacks. Always 0 for puml.
+    :rtype: int
+    """
+    level = 0
+    if configuration["file_type"] == "dot":
+        dot_options = get_dot_options(configuration, in_states)
+        if debug_dump_dir is not None:
+            debug_dumper.dump(debug_dump_dir, export_to_dot(statechart, **dot_options))
+        data, level = render_with_fallbacks(statechart, dot_options, configuration.get("split_regions", False),
+                                            configuration.get("layout_timeout"))
+        with metrics.timer("sismic_viz_phase_seconds", phase="file_io"):
+            with open(imagepath, "wb") as f:
+                f.write(data)
+    else:
+        from sismic.io import export_to_plantuml
+
+        data = render_plantuml(export_to_plantuml(statechart))
+        with metrics.timer("sismic_viz_phase_seconds", phase="file_io"):
+            with open(imagepath, "wb") as f:
+                f.write(data)
+    return level
+
+
+def complete_configuration(sc, states):
+    """
+    Adds to states the states that are entered with them: all children of orthogonal states, and the initial child
+    of compound states that have no active child.
+
+    :rtype: frozenset
+    """
+    states = set(states)
+    pending = list(states)
+    while pending:
+        state = sc.state_for(pending.pop())
+        if isinstance(state, OrthogonalState):
+            children = sc.children_for(state.name)
+        elif isinstance(state, CompoundState) and state.initial and \
+                not any(child in states for child in sc.children_for(state.name)):
+            children = [state.initial]
+        else:
+            children = []
+        for child in children:
+            if child not in states:
+                states.add(child)
+                pending.append(child)
+    return frozenset(states)
+
+
+def get_next_configuration(sc, configuration, transition):
+    """
+    Returns the configuration after a transition, computed statically the way sismic computes its steps. Entering a
+    history state enters its initial memory, since the actual memory depends on the execution.
+
+    :param frozenset configuration: Active states, where the source of transition is.
+    :rtype: frozenset
+    """
+    if transition.target is None:
+        return configuration
+
+    target = transition.target
+    if isinstance(sc.state_for(target), HistoryStateMixin):
+        target = sc.state_for(target).memory or sc.parent_for(target)
+
+    lca = sc.least_common_ancestor(transition.source, transition.target)
+    if lca is None:
+        exited, entered = set(configuration), [target] + sc.ancestors_for(target)
+    else:
+        last_before_lca = transition.source
+        for state_name in sc.ancestors_for(transition.source):
+            if state_name == lca:
+                break
+            last_before_lca = state_name
+        exited = set(sc.descendants_for(last_before_lca))
+        exited.add(last_before_lca)
+
+        entered = []
+        for state_name in [target] + sc.ancestors_for(target):
+            if state_name == lca:
+                break
+            entered.append(state_name)
+
+    return complete_configuration(sc, (configuration - exited).union(entered))
+
+
+def select_transitions(sc, transitions, true_guards=None):
+    """
+    Returns the transitions that sismic takes among the transitions for an event from active states: transitions from
+    descendants take priority over transitions from their ancestors, and from every state, only the first transition
+    of the highest priority class that has a true guard is taken.
+
+    :param list transitions: Transitions from active states, in the order of sc.transitions.
+    :param true_guards: Transitions whose guard is true, or None if all guards are true. Transitions without guard
+        are always taken into account.
+    :rtype: list
+    """
+    transitions_for = OrderedDict()
+    for transition in transitions:
+        transitions_for.setdefault(transition.source, []).append(transition)
+
+    selected = []
+    ignored = set()
+    for source in sorted(transitions_for, key=lambda state_name: -sc.depth_for(state_name)):
+        if source in ignored:
+            continue
+        candidates = transitions_for[source]
+        for priority in sorted(set(transition.priority for transition in candidates), reverse=True):
+            enabled = [transition for transition in candidates if transition.priority == priority and (
+                transition.guard is None or true_guards is None or transition in true_guards)]
+            if enabled:
+                selected.append(enabled[0])
+                ignored.update(sc.ancestors_for(source))
+                break
+    return selected
+
+
+def get_event_configuration(sc, configuration, transitions, true_guards=None):
+    """
+    Returns the configuration after the transitions that select_transitions selects are taken together.
+
+    :rtype: frozenset
+    """
+    next_configuration = configuration
+    for transition in select_transitions(sc, transitions, true_guards):
+        next_configuration = get_next_configuration(sc, next_configuration, transition)
+    return next_configuration
+
+
+def _get_guard_cases(transitions):
+    """
+    :return: The values of true_guards of select_transitions that explore_configurations tries: all guards true,
+        all guards false, and every guard true alone.
+    """
+    guarded = [transition for transition in transitions if transition.guard is not None]
+    cases = [None]
+    if guarded:
+        cases.append(set())
+        cases.extend(set([transition]) for transition in guarded)
+    return cases
+
+
+def explore_configurations(sc, max_configurations=None, all_guards_true=False):
+    """
+    Finds the configurations reachable from the initial configuration, with all guards treated as unknown. For every
+    event, the transitions from active states are selected as sismic does, with all guards true, all guards false,
+    and every guard true alone. Eventless transitions are followed too, and events are only considered in
+    configurations where the eventless transitions may all be blocked. The result is exact for statecharts without
+    guards.
+
+    :param int max_configurations: Stop exploring after finding this many configurations. Default: no limit.
+    :param bool all_guards_true: Only follow the steps taken when all guards are true.
+    :return: Dict from every configuration found, as a frozenset, to a sorted list of (event, next configuration),
+        where event is "" for eventless transitions, and whether all reachable configurations were found.
+    :rtype: (dict, bool)
+    """
+    initial = complete_configuration(sc, [sc.root])
+    successors = OrderedDict([(initial, None)])
+    pending = [initial]
+    while pending:
+        configuration = pending.pop(0)
+        transitions_for = OrderedDict([("", [])])
+        for transition in sc.transitions:
+            if transition.source in configuration:
+                transitions_for.setdefault(transition.event or "", []).append(transition)
+
+        steps = set()
+        for event, transitions in transitions_for.items():
+            for true_guards in [None] if all_guards_true else _get_guard_cases(transitions):
+                if select_transitions(sc, transitions, true_guards):
+                    steps.add((event, get_event_configuration(sc, configuration, transitions, true_guards)))
+            if not event and select_transitions(sc, transitions, None if all_guards_true else set()):
+                # Eventless transitions are taken whatever the guards, before any event is processed.
+                break
+        successors[configuration] = sorted(steps, key=lambda step: (step[0], sorted(step[1])))
+
+        for _, next_configuration in successors[configuration]:
+            if next_configuration in successors:
+                continue
+            if max_configurations is not None and len(successors) >= max_configurations:
+                return dict((key, value) for key, value in successors.items() if value is not None), False
+            successors[next_configuration] = None
+            pending.append(next_configuration)
+
+    return dict(successors), True
+
+
+def prerender_configurations(sc, configuration, jobs=None, max_configurations=None):
+    """
+    Renders every configuration of sc found by explore_configurations with a pool of threads, so that later
+    create_image calls with the same display options are served from render_cache.
+
+    :param dict configuration: Display options, like global_config.
+    :param int jobs: Number of threads. Default: number of CPUs.
+    :param int max_configurations: Maximal number of configurations to render. Default: the size of render_cache.
+    :return: Number of configurations rendered.
+    :rtype: int
+    """
+    if configuration["file_type"] != "dot":
+        return 0
+
+    max_configurations = render_cache.maxsize if max_configurations is None else max_configurations
+    successors, _ = explore_configurations(sc, max_configurations)
+
+    def render(states):
+        try:
+            render_with_fallbacks(sc, get_dot_options(configuration, sorted(states)),
+                                  configuration.get("split_regions", False), configuration.get("layout_timeout"))
+        except RenderError as e:
+            print("failed to prerender {}: {}".format(sorted(states), e), file=sys.stderr)
+
+    pool = ThreadPool(jobs or multiprocessing.cpu_count())
+    try:
+        pool.map(render, list(successors), chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+    return len(successors)
+
+
+prerendered_options = None
+
+
+def start_prerendering(sc, configuration):
+    """
+    Runs prerender_configurations on a daemon thread, with a copy of configuration, unless it was already started
+    for the same statechart and display options.
+
+    :return: The thread, or None if it was not started.
+    """
+    global prerendered_options
+
+    options = (id(sc), configuration["file_type"], sorted(get_dot_options(configuration, ()).items()),
+               configuration.get("split_regions", False), configuration.get("layout_timeout"))
+    if options == prerendered_options:
+        return None
+    prerendered_options = options
+
+    thread = threading.Thread(target=prerender_configurations, args=(sc, dict(configuration)))
+    thread.daemon = True
+    thread.start()
+    return thread
+
+
+def get_layout_note_html(level, timeout):
+    if not level:
+        return ""
+    if level < len(layout_fallbacks):
+        return template_layout_note.format(timeout=timeout, layout=layout_fallbacks[level][0])
+    return template_layout_note.format(timeout=timeout, layout="no layout")
+
+
+template_bound_doc = """
+<html>
+    <head>{refresh_head}    </head>
+    <body>
+        clock: <div id="clock">{clock_time:10.3f}{stopped}</div><br/>{states}<br/><a href=\"/shutdown?{timestamp}\">shutdown server</a>
+        <br/>
+        <img src=\"statechart.svg?{timestamp}\" id=\"statechart\" style=\"max-width:100%; height:auto;\"/>
+        <br/>
+        <div id="history">
+{history}
+        </div>
+    </body>
+</html>
+"""
+
+
+# template_refresh_head = "<meta http-equiv=\"refresh\" content=\"1; URL=/\">"
+template_refresh_head = """
+        <script src="https://ajax.googleapis.com/ajax/libs/jquery/3.2.1/jquery.min.js"></script>
+        <script>
+            setInterval(function() {
+                var myImageElement = document.getElementById('statechart');
+                myImageElement.src = 'statechart.svg?rand=' + Math.random();
+                $('#clock').load("clock?rand=" + Math.random());
+                $('#history').load("history?rand=" + Math.random());
+            }, 1000);
+        </script>
+"""
+
+
+template_bound_history = "clock: {clock_time:10.3f}, events: {events}, in states: {states}"
+
+
+def shrink_list(l):
+    if l:
+        ll = [[l[0], 1]]
+        for elem in l[1:]:
+            if elem == ll[-1][0]:
+                ll[-1][1] += 1
+            else:
+                ll.append([elem, 1])
+        return ", ".join(elem if times == 1 else "{} x {}".format(elem, times) for elem, times in ll)
+    else:
+        return ""
+
+
+class BoundStatechartView(object):
+    """
+    Callback for attaching to an interpreter, that keeps track of the interpreter configuration, clock and history of
+    configurations, as received through metaevents.
+
+    :param float time_factor: Divide time clock by this number.
+    """
+    def __init__(self, time_factor=1.):
+        self.time_factor = time_factor
+        self.configuration = set()
+        self.history = []
+        self.clock_time = 0
+        self._last_printed_configuration = set()
+        self._events = []
+
+    def __call__(self, metaevent):
+        """
+        :type metaevent: sismic.model.MetaEvent
+        """
+        metrics.inc("sismic_viz_callback_metaevents_total")
+
+        if metaevent.name == "state entered":
+            self.configuration.add(metaevent.state)
+        elif metaevent.name == "state exited":
+            self.configuration.remove(metaevent.state)
+        elif metaevent.name == "event consumed" and metaevent.event.name:
+            self._events.append(metaevent.event.name)
+        elif metaevent.name == "step started":
+            self.clock_time = metaevent.time
+            if self.configuration != self._last_printed_configuration:
+                self.history.append(template_bound_history.format(clock_time=self.clock_time / self.time_factor,
+                                                                  events=shrink_list(self._events),
+                                                                  states=", ".join(self.configuration)))
+                self._last_printed_configuration.clear()
+                self._last_printed_configuration.update(self.configuration)
+                self._events[:] = []
+
+
+def get_bound_flask_app(statechart, view, imagepath, stop_event, logging=True):
+    """
+    Creates the flask app of server_to_bind.
+
+    :param sismic.model.Statechart statechart: Statechart to display.
+    :param BoundStatechartView view: Callback attached to the interpreter.
+    :param str imagepath: Path of the file to render images to.
+    :param threading.Event stop_event: Stops page refreshes when set.
+    :param bool logging: Whether to log requests.
+    """
+    from flask import Flask, send_file, request
+
+    app = Flask(__name__)
+    add_metrics_to_flask_app(app, "bound", lambda: len(view.history))
+    import logging as logging_
+    log = logging_.getLogger('werkzeug')
+    log.disabled = not logging
+
+    @app.route("/")
+    def index():
+        return get_page()
+
+    def get_page():
+        create_image(statechart, view.configuration, {
+            "file_type": "dot",
+            "edge_fontsize": 14,
+            "include_guards": False,
+            "include_actions": False,
+        }, imagepath)
+        return template_bound_doc.format(refresh_head="" if stop_event.is_set() else template_refresh_head,
+                                         clock_time=view.clock_time / view.time_factor,
+                                         stopped=" STOPPED" if stop_event.is_set() else "",
+                                         states=", ".join(view.configuration),
+                                         timestamp=time.time(),
+                                         history="<br/>\n".join(view.history[::-1]))
+
+    def shutdown_server():
+        func = request.environ.get('werkzeug.server.shutdown')
+        if func is None:
+            raise RuntimeError('Not running with the Werkzeug Server')
+        func()
+
+    @app.route('/statechart.svg')
+    def get_statechart_graph():
+        create_image(statechart, view.configuration, {
+            "file_type": "dot",
+            "edge_fontsize": 14,
+            "include_guards": False,
+            "include_actions": False,
+        }, imagepath)
+        return send_file(imagepath, mimetype="image/svg+xml")
+
+    @app.route("/clock")
+    def get_clock():
+        return "{clock_time:10.3f}{stopped}".format(
+            clock_time=view.clock_time / view.time_factor,
+            stopped=" STOPPED" if stop_event.is_set() else ""
+        )
+
+    @app.route("/history")
+    def get_history():
+        return "<br/>\n".join(view.history[::-1])
+
+    @app.route('/shutdown')
+    def shutdown():
+        shutdown_server()
+        return get_page()
+
+    return app
+
+
+@contextmanager
+def server_to_bind(statechart, open_browser=True, port=5000, time_factor=1., logging=True):
+    """
+    Starts a background flask server that displays the statechart, and returns a context manager that yields a callback
+    to attach to an interpreter. The displayed statechart is continuously updated to show the interpreter configuartion,
+    as received through the callback calls.
+
+    :param sismic.model.Statechart statechart: Statechart to display.
+    :param bool open_browser: Whether to open a browser for you.
+    :param int port: Port to use for server.
+    :param float time_factor: Divide time clock by this number.
+    :return: Callback for attaching to interpreter.
+    :rtype: BoundStatechartView
+    """
+    view = BoundStatechartView(time_factor=time_factor)
+
+    def background_server(stop_event):
+        """
+        :type stop_event: threading.Event
+        """
+        global imagefile_path
+        import webbrowser
+
+        with tempfile.NamedTemporaryFile() as imagefile:
+            imagefile_path = imagefile.name
+            app = get_bound_flask_app(statechart, view, imagefile_path, stop_event, logging=logging)
+
+            if open_browser:
+                webbrowser.open_new("http://127.0.0.1:{port}".format(port=port))
+            app.run(host='0.0.0.0', port=port, threaded=False)
+
+    _stop_event = threading.Event()
+    threading.Thread(target=background_server, args=(_stop_event,)).start()
+
+    try:
+        yield view
+    finally:
+        # _stop_event.set()
+        print("exitting sismic viz server")
+
+
+statechart_cache_version = 1
+
+
+def _parse_yaml(content):
+    from sismic.io import import_from_yaml
+
+    return import_from_yaml(text=content.decode("utf-8"))
+
+
+def _load_statechart_content(content):
+    """
+    Parses yaml content into a statechart, using the pickled statechart cached in cache_dir when there is one.
+    Cache entries are keyed by the content hash together with the sismic, python and cache format versions, and
+    unreadable entries are discarded and parsed again.
+
+    :param bytes content: Content of a yaml statechart file.
+    :rtype: sismic.model.Statechart
+    """
+    if cache_dir is None:
+        return _parse_yaml(content)
+
+    key = hashlib.sha1(content)
+    key.update("{}:{}:{}".format(statechart_cache_version, sismic.__version__, sys.version_info[:2]).encode("utf-8"))
+    dirname = os.path.join(cache_dir, "statecharts")
+    path = os.path.join(dirname, "{}.pickle".format(key.hexdigest()))
+
+    try:
+        with open(path, "rb") as f:
+            return pickle.load(f)
+    except IOError:
+        pass
+    except Exception:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    sc = _parse_yaml(content)
+
+    try:
+        if not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        with tempfile.NamedTemporaryFile(dir=dirname, delete=False) as f:
+            pickle.dump(sc, f, pickle.HIGHEST_PROTOCOL)
+        os.replace(f.name, path)
+    except (EnvironmentError, pickle.PicklingError):
+        pass
+
+    return sc
+
+
+def load_statechart(filepath):
+    """
+    Same as sismic.io.import_from_yaml(filepath=filepath), but skips parsing when the file is unchanged since it
+    was last loaded.
+
+    :param str filepath: Path to a yaml statechart file.
+    :rtype: sismic.model.Statechart
+    """
+    with open(filepath, "rb") as f:
+        return _load_statechart_content(f.read())
+
+
+# Code objects of guards, actions and contracts, keyed by mode and code text. Every interpreter created with
+# precompile enabled shares these dicts as its evaluator's code caches, so code is compiled once per process.
+compiled_code = {"eval": {}, "exec": {}}
+
+
+def iter_statechart_code(sc):
+    """
+    :return: Generator of (code, mode, description) for every guard, action, on_entry, on_exit and contract of a
+        statechart, where mode is the mode of the builtin compile function.
+    """
+    if sc.preamble:
+        yield sc.preamble, "exec", "preamble"
+
+    for state_name in sorted(sc.states):
+        state = sc.state_for(state_name)
+        for attr in ["on_entry", "on_exit"]:
+            if getattr(state, attr, None):
+                yield getattr(state, attr), "exec", "{} of state {}".format(attr, state_name)
+        for attr in ["preconditions", "postconditions", "invariants"]:
+            for condition in getattr(state, attr, []):
+                yield condition, "eval", "{} of state {}".format(attr[:-1], state_name)
+
+    for transition in sc.transitions:
+        if transition.guard:
+            yield transition.guard, "eval", "guard of {}".format(transition)
+        if transition.action:
+            yield transition.action, "exec", "action of {}".format(transition)
+        for attr in ["preconditions", "postconditions", "invariants"]:
+            for condition in getattr(transition, attr, []):
+                yield condition, "eval", "{} of {}".format(attr[:-1], transition)
+
+
+def precompile_statechart(sc):
+    """
+    Compiles all code of a statechart into compiled_code, the same way sismic's PythonEvaluator compiles it lazily.
+
+    :return: List of messages, one per code that doesn't compile.
+    """
+    errors = []
+    for code, mode, description in iter_statechart_code(sc):
+        if code in compiled_code[mode]:
+            continue
+        try:
+            compiled_code[mode][code] = compile(code, '<string>', mode)
+        except SyntaxError as e:
+            errors.append("{}: {} in {!r}".format(description, e.msg, code))
+    return errors
+
+
+def share_compiled_code(interpreter):
+    """
+    Makes the evaluator of an interpreter use compiled_code as its code caches.
+    """
+    evaluator = interpreter._evaluator
+    for mode, attr in [("eval", "_evaluable_code"), ("exec", "_executable_code")]:
+        if isinstance(getattr(evaluator, attr, None), dict):
+            compiled_code[mode].update(getattr(evaluator, attr))
+            setattr(evaluator, attr, compiled_code[mode])
+
+
+def create_interp():
+    global interp, yaml_filepath
+
+    from sismic.interpreter import Interpreter
+
+    daemon = load_statechart(yaml_filepath)
+    if global_config["precompile"]:
+        for error in precompile_statechart(daemon):
+            print("syntax error in {}".format(error), file=sys.stderr)
+
+    interp = Interpreter(daemon)
+    if global_config["precompile"]:
+        share_compiled_code(interp)
+    return interp
+
+
+def deepcopy_or_share(value, memo):
+    """
+    Returns copy.deepcopy(value, memo), or value itself if it can't be deep copied, like a module imported by a
+    preamble or an open file. A failed copy leaves nothing in memo, except value shared as its own copy.
+    """
+    size = len(memo)
+    try:
+        return copy.deepcopy(value, memo)
+    except Exception:
+        # Entries added by the failed copy may be incomplete copies.
+        for key in list(memo)[size:]:
+            del memo[key]
+        memo[id(value)] = value
+        return value
+
+
+def copy_context(context, memo):
+    """
+    Deep copies the values of an interpreter context with deepcopy_or_share, into a new dict that memo maps the
+    context to, so that a deep copy of the interpreter with memo uses it.
+
+    :rtype: dict
+    """
+    result = memo[id(context)] = {}
+    for key, value in dict.items(context):
+        if isinstance(context, CopyOnWriteDict) and key in context._shared and id(value) in context._memo:
+            # Another name for a value that context already copied, and maybe changed, through another key.
+            value = context._memo[id(value)]
+        result[key] = deepcopy_or_share(value, memo)
+    return result
+
+
+class CopyOnWriteDict(dict):
+    """
+    Dict that starts as a shallow copy of base, and deep copies a mutable value of base the first time it is read,
+    so that base is never modified through it, while immutable values are never copied. changed holds the keys that
+    were written or deleted, or whose value was copied and so may have been modified in place.
+    """
+    immutable_types = (int, float, complex, bool, str, bytes, type(None), range, type)
+
+    def __init__(self, base):
+        dict.__init__(self, base)
+        self._shared = set(key for key, value in base.items() if not isinstance(value, self.immutable_types))
+        self._memo = {}
+        self.changed = set()
+
+    def _own(self, key):
+        if key in self._shared:
+            self._shared.discard(key)
+            value = dict.__getitem__(self, key)
+            owned = deepcopy_or_share(value, self._memo)
+            if owned is not value:
+                self.changed.add(key)
+                dict.__setitem__(self, key, owned)
+
+    def _own_all(self):
+        for key in list(self._shared):
+            self._own(key)
+
+    def __getitem__(self, key):
+        self._own(key)
+        return dict.__getitem__(self, key)
+
+    def __setitem__(self, key, value):
+        self._shared.discard(key)
+        self.changed.add(key)
+        dict.__setitem__(self, key, value)
+
+    def __delitem__(self, key):
+        self._shared.discard(key)
+        self.changed.add(key)
+        dict.__delitem__(self, key)
+
+    def __iter__(self):
+        # Defined so that dict(self) and {**self} go through __getitem__, instead of copying the dict storage.
+        return dict.__iter__(self)
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+    def setdefault(self, key, default=None):
+        if key in self:
+            return self[key]
+        self[key] = default
+        return default
+
+    def pop(self, key, *default):
+        self._own(key)
+        self._shared.discard(key)
+        self.changed.add(key)
+        return dict.pop(self, key, *default)
+
+    def popitem(self):
+        self._own_all()
+        key, value = dict.popitem(self)
+        self.changed.add(key)
+        return key, value
+
+    def update(self, *args, **kwargs):
+        for key, value in dict(*args, **kwargs).items():
+            self[key] = value
+
+    def clear(self):
+        self._shared.clear()
+        self.changed.update(dict.keys(self))
+        dict.clear(self)
+
+    def items(self):
+        self._own_all()
+        return dict.items(self)
+
+    def values(self):
+        self._own_all()
+        return dict.values(self)
+
+    def copy(self):
+        self._own_all()
+        return dict(self)
+
+
+# Interpreter right after its first execution, see take_snapshot.
+interp_snapshot = None
+
+
+def take_snapshot(interpreter):
+    """
+    Returns a deep copy of an interpreter, that shares its statechart and compiled code with it, as well as context
+    values that can't be deep copied.
+
+    :rtype: sismic.interpreter.Interpreter
+    """
+    memo = _get_snapshot_memo(interpreter)
+    copy_context(interpreter._evaluator._context, memo)
+    return _deepcopy_interpreter(interpreter, memo)
+
+
+def restore_snapshot(snapshot):
+    """
+    Returns a new interpreter in the state of snapshot, as taken by take_snapshot. The context of the new interpreter
+    is a CopyOnWriteDict of the snapshot context, so only mutable values that are used get copied, and the snapshot
+    can be restored again.
+
+    :rtype: sismic.interpreter.Interpreter
+    """
+    memo = _get_snapshot_memo(snapshot)
+    context = snapshot._evaluator._context
+    memo[id(context)] = CopyOnWriteDict(context)
+    return _deepcopy_interpreter(snapshot, memo)
+
+
+def _get_snapshot_memo(interpreter):
+    return {id(interpreter.statechart): interpreter.statechart}
+
+
+def _deepcopy_interpreter(interpreter, memo):
+    """
+    Returns copy.deepcopy(interpreter, memo), with the compiled code caches of interpreter. They can't be shared
+    through memo, because PythonEvaluator.__getstate__ replaces them with empty dicts.
+    """
+    result = copy.deepcopy(interpreter, memo)
+    for attr in ["_evaluable_code", "_executable_code"]:
+        if hasattr(interpreter._evaluator, attr):
+            setattr(result._evaluator, attr, getattr(interpreter._evaluator, attr))
+    return result
+
+
+def reset_interp():
+    """
+    Brings interp back to its state right after its first execution, from interp_snapshot, or from the yaml file if
+    there is no snapshot.
+    """
+    global interp
+
+    if interp_snapshot is None:
+        create_interp()
+        disable_keyerror_in_actions()
+        interp.execute()
+    else:
+        interp = restore_snapshot(interp_snapshot)
+
+
+class Checkpoints(object):
+    """
+    States of an interpreter after every event submission, for going back to any of them. Every checkpoint holds a
+    deep copy of the interpreter without its context. Contexts are stored as the values that changed since the
+    previous checkpoint, with a full copy every full_every checkpoints and for the oldest checkpoint.
+
+    Changes are tracked by running the interpreter, after every checkpoint, on a CopyOnWriteDict of the context at
+    that checkpoint, that records the keys written, deleted, or whose mutable value was read.
+
+    :param int full_every: Number of checkpoints between full copies of the context.
+    :param int max_checkpoints: Number of checkpoints to keep. Older checkpoints are dropped.
+    """
+    def __init__(self, full_every=10, max_checkpoints=100):
+        self.full_every = full_every
+        self.max_checkpoints = max_checkpoints
+        self._entries = []
+        self._base = None
+        self._tracked = None
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def labels(self):
+        return [entry["label"] for entry in self._entries]
+
+    def get_history_size(self, ind):
+        return self._entries[ind]["history_size"]
+
+    def clear(self):
+        del self._entries[:]
+        self._base = self._tracked = None
+
+    @staticmethod
+    def _copy_without_context(interpreter):
+        memo = _get_snapshot_memo(interpreter)
+        memo[id(interpreter._evaluator._context)] = {}
+        return _deepcopy_interpreter(interpreter, memo)
+
+    def push(self, interpreter, label, history_size):
+        """
+        Adds a checkpoint of interpreter, and makes it track the changes of its context from now on.
+
+        :param str label: Text of links to the checkpoint.
+        :param int history_size: Number of history entries at the checkpoint.
+        """
+        context = interpreter._evaluator._context
+        entry = {"label": label, "history_size": history_size, "shell": self._copy_without_context(interpreter)}
+
+        if context is not self._tracked or len(self._entries) % self.full_every == 0:
+            base = entry["full"] = copy_context(context, {})
+        else:
+            changed = dict((key, dict.__getitem__(context, key))
+                           for key in context.changed if dict.__contains__(context, key))
+            for key in context._shared:
+                value = dict.__getitem__(context, key)
+                if id(value) in context._memo:
+                    # Another name for a value that was copied, and maybe changed, through another key.
+                    changed[key] = context._memo[id(value)]
+            memo = {}
+            entry["changed"] = dict((key, deepcopy_or_share(value, memo)) for key, value in changed.items())
+            entry["deleted"] = [key for key in context.changed
+                                if key in self._base and not dict.__contains__(context, key)]
+
+            base = dict(self._base)
+            for key in entry["deleted"]:
+                del base[key]
+            base.update(entry["changed"])
+
+        self._entries.append(entry)
+        self._track(interpreter, base)
+
+        if len(self._entries) > self.max_checkpoints:
+            if "full" not in self._entries[1]:
+                self._entries[1]["full"] = self._get_context(1)
+            del self._entries[0]
+
+    def _track(self, interpreter, base):
+        self._base = base
+        self._tracked = interpreter._evaluator._context = CopyOnWriteDict(base)
+
+    def _get_context(self, ind):
+        start = ind
+        while "full" not in self._entries[start]:
+            start -= 1
+
+        context = dict(self._entries[start]["full"])
+        for entry in self._entries[start + 1:ind + 1]:
+            for key in entry["deleted"]:
+                del context[key]
+            context.update(entry["changed"])
+        return context
+
+    def restore(self, ind):
+        """
+        Returns a new interpreter in the state of checkpoint ind, and drops the checkpoints after it.
+
+        :rtype: sismic.interpreter.Interpreter
+        """
+        shell = self._entries[ind]["shell"]
+        base = self._get_context(ind)
+
+        memo = _get_snapshot_memo(shell)
+        memo[id(shell._evaluator._context)] = CopyOnWriteDict(base)
+        interpreter = _deepcopy_interpreter(shell, memo)
+
+        del self._entries[ind + 1:]
+        self._base = base
+        self._tracked = interpreter._evaluator._context
+        return interpreter
+
+
+checkpoints = Checkpoints()
+
+
+class CallMe(object):
+    def __call__(self, *args, **kwargs):
+        return self
+
+    def __getattribute__(self, name):
+        return self
+
+
+class NoKeyErrorGlobals(dict):
+    """
+    Globals for code executed with KeyErrors disabled. Holds the names exposed by the evaluator, and looks up other
+    names in the interpreter context, then in builtins, and returns a CallMe for names that are nowhere.
+    The context is referenced, not copied.
+    """
+    def __init__(self, exposed, context):
+        dict.__init__(self, exposed)
+        self.context = context
+
+    def __missing__(self, name):
+        try:
+            return self.context[name]
+        except KeyError:
+            pass
+        try:
+            return getattr(builtins, name)
+        except AttributeError:
+            return CallMe()
+
+
+class NoKeyErrorLocals(object):
+    """
+    Locals for code executed with KeyErrors disabled. Names are looked up in the interpreter context, then in
+    globals_, and assignments go to the context.
+
+    :param dict context: Interpreter context.
+    :param NoKeyErrorGlobals globals_: Globals the code is executed with.
+    """
+    __slots__ = ("context", "globals_")
+
+    def __init__(self, context, globals_):
+        self.context = context
+        self.globals_ = globals_
+
+    def __getitem__(self, name):
+        try:
+            return self.context[name]
+        except KeyError:
+            return self.globals_[name]
+
+    def __setitem__(self, name, value):
+        self.context[name] = value
+
+    def __delitem__(self, name):
+        del self.context[name]
+
+
+def disable_keyerror_in_actions():
+    from future.utils import raise_from
+    from sismic.exceptions import CodeEvaluationError
+    from types import MethodType
+
+    if not hasattr(interp._evaluator, "old_execute_code"):
+        interp._evaluator.old_execute_code = interp._evaluator._execute_code
+
+        def new_execute_code(self, code, **kwargs):
+            additional_context = kwargs.get("additional_context")
+
+            if code is None:
+                return []
+
+            compiled_code = self._executable_code.get(code, None)
+            if compiled_code is None:
+                compiled_code = self._executable_code.setdefault(code, compile(code, '<string>', 'exec'))
+
+            exposed_context = getattr(self, "_no_keyerror_exposed_context", None)
+            if exposed_context is None:
+                exposed_context = self._no_keyerror_exposed_context = {
+                    'active': self._time_provider.active,
+                    'time': self._time_provider.time,
+                    'send': self._event_provider.send,
+                    'notify': self._event_provider.notify,
+                    'setdefault': self._setdefault,
+                }
+
+            globals_ = NoKeyErrorGlobals(exposed_context, self._context)
+            if additional_context is not None:
+                globals_.update(additional_context)
+
+            try:
+                exec (compiled_code, globals_, NoKeyErrorLocals(self._context, globals_))  # type: ignore
+                return self._event_provider.pending
+            except Exception as e:
+                raise_from(CodeEvaluationError('"{}" occurred while executing "{}"'.format(e, code)), e)
+
+        interp._evaluator._execute_code = MethodType(new_execute_code, interp._evaluator)
 
     if not hasattr(interp._evaluator, "old_eval_code"):
         interp._evaluator.old_eval_code = interp._evaluator._evaluate_code
@@ -584,17 +2541,21 @@ def enable_keyerror_in_actions():
         del interp._evaluator.old_execute_code
 
     if hasattr(interp._evaluator, "old_eval_code"):
-        interp._evaluator._evaluate_code = interp._evaluator.old_val_code
-        del interp._evaluator.old_eal_code
+        interp._evaluator._evaluate_code = interp._evaluator.old_eval_code
+        del interp._evaluator.old_eval_code
 
 
 def run_interactive(filepath):
-    global imagefile_path, yaml_filepath
+    global imagefile_path, yaml_filepath, interp_snapshot
+    import webbrowser
 
     yaml_filepath = filepath
     interp = create_interp()
     disable_keyerror_in_actions()
     interp.execute()
+    interp_snapshot = take_snapshot(interp)
+    if global_config["prerender"]:
+        start_prerendering(interp.statechart, global_config)
 
     with tempfile.NamedTemporaryFile() as imagefile:
         imagefile_path = imagefile.name
@@ -602,16 +2563,469 @@ def run_interactive(filepath):
         get_flask_app().run(host='0.0.0.0', threaded=False)
 
 
+def get_file_hash(filepath):
+    with open(filepath, "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def expand_input_files(patterns):
+    """
+    Expands glob patterns into a list of paths, keeping order and dropping duplicates.
+    Patterns that match nothing are kept as is, so that missing files are reported when read.
+    """
+    paths = []
+    for pattern in patterns:
+        for path in sorted(glob.glob(pattern)) or [pattern]:
+            if path not in paths:
+                paths.append(path)
+    return paths
+
+
+def convert_file(input_file, output_file, file_type="dot", split_regions=False, **dot_options):
+    """
+    Converts a yaml statechart file to a dot or puml file, or to any format dot can produce.
+    Keyword arguments of export_to_dot, like include_guards or focus, are passed on to it, and split_regions to
+    render_statechart.
+    """
+    sc = load_statechart(input_file)
+
+    if file_type == "puml":
+        from sismic.io import export_to_plantuml
+
+        with open_output_file(output_file) as f:
+            f.write(export_to_plantuml(sc))
+        return
+
+    if file_type == "dot":
+        with open_output_file(output_file) as f:
+            f.write(export_to_dot(sc=sc, **dot_options))
+    else:
+        data = render_statechart(sc, file_type, split_regions=split_regions, **dot_options)
+        with open_output_file(output_file, "wb") as f:
+            f.write(data)
+
+
+def get_metaevent_record(metaevent, clock_time):
+    """
+    :return: JSON serializable dict of a sismic MetaEvent, with its data converted to strings.
+    """
+    return {
+        "time": clock_time,
+        "name": metaevent.name,
+        "data": {key: value if isinstance(value, (int, float, bool, type(None))) else str(value)
+                 for key, value in metaevent.data.items()},
+    }
+
+
+def run_scenario(input_file, scenario_file, output_file, file_type="svg", trace_file=None, stats_file=None,
+                 split_regions=False, **dot_options):
+    """
+    Runs a scenario on a statechart without any rendering, and renders the final configuration once. The interpreter
+    uses a simulated clock, which only advances by the delays of the scenario events.
+
+    :param str input_file: Path to a yaml statechart file.
+    :param str scenario_file: Path to a JSON list of events, in the format of the /events endpoint.
+    :param str output_file: Path to write the final configuration to, in file_type.
+    :param str file_type: dot, or any format dot can produce.
+    :param str trace_file: Path to write the metaevents sent by the interpreter to, one JSON object per line.
+    :param str stats_file: Path to write JSON statistics of the run to.
+    :param dot_options: Keyword arguments of export_to_dot, except configuration.
+    :return: Statistics of the run.
+    :rtype: dict
+    """
+    from sismic.interpreter import Interpreter
+
+    start = default_timer()
+    sc = load_statechart(input_file)
+    with open(scenario_file) as f:
+        events = parse_event_specs(json.load(f))
+    load_time = default_timer() - start
+
+    trace = []
+    metaevent_count = [0]
+    interpreter = Interpreter(sc)
+
+    def listener(metaevent):
+        metaevent_count[0] += 1
+        if trace_file is not None:
+            trace.append(get_metaevent_record(metaevent, interpreter.clock.time))
+
+    interpreter.attach(listener)
+
+    start = default_timer()
+    macro_steps = interpreter.execute()
+    macro_steps.extend(execute_events(interpreter, events))
+    execute_time = default_timer() - start
+
+    start = default_timer()
+    dot_options = dict(dot_options, configuration=interpreter.configuration)
+    if file_type == "dot":
+        with open_output_file(output_file) as f:
+            f.write(export_to_dot(sc, **dot_options))
+    else:
+        data = render_statechart(sc, file_type, split_regions=split_regions, **dot_options)
+        with open_output_file(output_file, "wb") as f:
+            f.write(data)
+    render_time = default_timer() - start
+
+    if trace_file is not None:
+        with open(trace_file, "w") as f:
+            for record in trace:
+                f.write(json.dumps(record, sort_keys=True) + "\n")
+
+    stats = {
+        "events": len(events),
+        "macro_steps": len(macro_steps),
+        "micro_steps": sum(len(macro_step.steps) for macro_step in macro_steps),
+        "metaevents": metaevent_count[0],
+        "clock_time": interpreter.clock.time,
+        "configuration": interpreter.configuration,
+        "load_seconds": load_time,
+        "execute_seconds": execute_time,
+        "render_seconds": render_time,
+    }
+    if stats_file is not None:
+        with open(stats_file, "w") as f:
+            json.dump(stats, f, indent=2, sort_keys=True)
+    return stats
+
+
+template_site_doc = """<html>
+    <head>
+        <meta charset="utf-8"/>
+        <title>{name}</title>
+    </head>
+    <body>
+        <div id="statechart"></div>
+        <div>
+            Active states: <span id="states"></span>
+        </div>
+        <div>
+            Click to trigger an event:<br/>
+            <div id="events"></div>
+        </div>
+        <br/>
+        <div>
+            <a href="#0">Click here</a> to start from the beginning.
+            Guards are assumed to be true.
+        </div>
+        <script>
+            var configurations = {configurations};
+            var transitions = {transitions};
+
+            function show() {{
+                var ind = parseInt(window.location.hash.substring(1), 10);
+                if (!(ind >= 0 && ind < configurations.length)) {{
+                    ind = 0;
+                }}
+                document.getElementById("statechart").innerHTML =
+                    '<object type="image/svg+xml" style="max-width:100%; height:auto;" ' +
+                    'data="configurations/' + ind + '.svg"></object>';
+                document.getElementById("states").textContent = configurations[ind].join(", ");
+
+                var events = document.getElementById("events");
+                events.innerHTML = "";
+                transitions[ind].forEach(function (step) {{
+                    var button = document.createElement("button");
+                    button.textContent = step[0] || "(no event)";
+                    button.onclick = function () {{
+                        window.location.hash = "#" + step[1];
+                    }};
+                    events.appendChild(button);
+                    events.appendChild(document.createElement("br"));
+                }});
+            }}
+
+            window.onhashchange = show;
+            show();
+        </script>
+    </body>
+</html>
+"""
+
+template_site_state_css = """
+#state_{state_name} > path, #state_{state_name} > polygon {{ stroke: #3399ff; }}
+.node#state_{state_name} > path, .node#state_{state_name} > polygon {{ fill: #3399ff; }}
+.from_{state_name} > path, .from_{state_name} > polygon {{ stroke: #3399ff; }}
+.from_{state_name} > polygon {{ fill: #3399ff; }}"""
+
+
+def highlight_svg(svg, configuration):
+    """
+    Adds a style element to an svg rendered with export_to_dot(element_ids=True), that colors a configuration the
+    way export_to_dot(configuration=configuration) does.
+
+    :param bytes svg: Rendered svg.
+    :rtype: bytes
+    """
+    css = "".join(template_site_state_css.format(state_name=state_name) for state_name in sorted(configuration))
+    start = svg.index(b"<svg")
+    end = svg.index(b">", start) + 1
+    return b"".join([svg[:end], b"\n<style>", css.encode("utf-8"), b"\n</style>", svg[end:]])
+
+
+def export_static_site(input_file, output_dir, jobs=None, max_configurations=1000, split_regions=False,
+                       **dot_options):
+    """
+    Writes a static html site that walks through the configurations of a statechart, as found by
+    explore_configurations with all guards true. The statechart is laid out once, and the svg of every configuration
+    is made from that layout by adding CSS that highlights the configuration.
+
+    :param str input_file: Path to a yaml statechart file.
+    :param str output_dir: Directory to write index.html and configurations/<index>.svg to.
+    :param int jobs: Number of threads writing svg files. Default: number of CPUs.
+    :param int max_configurations: Maximal number of configurations to export.
+    :param bool split_regions: See render_statechart.
+    :param dot_options: Keyword arguments of export_to_dot, except configuration and collapse_inactive.
+    :return: Number of configurations exported, and whether all reachable configurations were found.
+    :rtype: (int, bool)
+    """
+    sc = load_statechart(input_file)
+    successors, complete = explore_configurations(sc, max_configurations, all_guards_true=True)
+
+    configurations = sorted(successors, key=lambda configuration: (len(configuration), sorted(configuration)))
+    initial = complete_configuration(sc, [sc.root])
+    configurations.remove(initial)
+    configurations.insert(0, initial)
+    indices = dict((configuration, ind) for ind, configuration in enumerate(configurations))
+
+    transitions = [[(event, indices[next_configuration]) for event, next_configuration in successors[configuration]
+                    if next_configuration in indices]
+                   for configuration in configurations]
+
+    svg = render_statechart(sc, "svg", split_regions=split_regions, element_ids=True, **dot_options)
+
+    dirname = os.path.join(output_dir, "configurations")
+    if not os.path.isdir(dirname):
+        os.makedirs(dirname)
+
+    def write_svg(item):
+        ind, configuration = item
+        with open(os.path.join(dirname, "{}.svg".format(ind)), "wb") as f:
+            f.write(highlight_svg(svg, configuration))
+
+    pool = ThreadPool(jobs or multiprocessing.cpu_count())
+    try:
+        pool.map(write_svg, list(enumerate(configurations)), chunksize=16)
+    finally:
+        pool.close()
+        pool.join()
+
+    def to_script(value):
+        return json.dumps(value).replace("</", "<\\/")
+
+    with open(os.path.join(output_dir, "index.html"), "w") as f:
+        f.write(template_site_doc.format(
+            name=sc.name,
+            configurations=to_script([sorted(configuration, key=lambda state_name: (sc.depth_for(state_name),
+                                                                                      state_name))
+                                      for configuration in configurations]),
+            transitions=to_script(transitions),
+        ))
+
+    return len(configurations), complete
+
+
+batch_manifest_name = ".sismic-viz-manifest.json"
+
+
+def get_output_name(input_file, file_type):
+    return "{}.{}".format(os.path.splitext(os.path.basename(input_file))[0], file_type)
+
+
+def _convert_batch_job(job):
+    global cache_dir
+
+    input_file, output_file, options, job_cache_dir = job
+    # Workers started with spawn or forkserver import this module again, without the cache_dir set by main.
+    cache_dir = job_cache_dir
+    try:
+        convert_file(input_file, output_file, **options)
+    except Exception as e:
+        return input_file, "{}: {}".format(type(e).__name__, e)
+    return input_file, None
+
+
+def convert_batch(input_files, output_dir, file_type="dot", jobs=None, force=False, **dot_options):
+    """
+    Converts many yaml statechart files into output_dir, one output file per input, across a pool of processes.
+    A manifest in output_dir records the content hash and options of every converted input, and inputs that are
+    unchanged since the last run are skipped.
+
+    :param list input_files: Paths to input yaml files.
+    :param str output_dir: Directory for output files, created if missing.
+    :param int jobs: Number of worker processes. Default: number of CPUs.
+    :param bool force: Convert all inputs, even unchanged ones.
+    :param dot_options: Keyword arguments of export_to_dot.
+    :return: Pairs of input file and error message, for every input that failed.
+    :rtype: list
+    """
+    options = dict(dot_options, file_type=file_type)
+
+    if not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+
+    manifest_path = os.path.join(output_dir, batch_manifest_name)
+    try:
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+    except (IOError, ValueError):
+        manifest = {}
+
+    failures = []
+    pending = []
+    keys = {}
+    skipped = 0
+    for input_file in input_files:
+        output_name = get_output_name(input_file, file_type)
+        if output_name in keys:
+            failures.append((input_file, "output file {} is already produced by another input".format(output_name)))
+            continue
+
+        try:
+            keys[output_name] = {"hash": get_file_hash(input_file), "options": options}
+        except EnvironmentError as e:
+            failures.append((input_file, "{}: {}".format(type(e).__name__, e)))
+            continue
+
+        output_file = os.path.join(output_dir, output_name)
+        if not force and manifest.get(output_name) == keys[output_name] and os.path.exists(output_file):
+            skipped += 1
+        else:
+            manifest.pop(output_name, None)
+            pending.append((input_file, output_file, options, cache_dir))
+
+    if len(pending) > 1 and jobs != 1:
+        pool = multiprocessing.Pool(jobs)
+        try:
+            results = pool.map(_convert_batch_job, pending, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [_convert_batch_job(job) for job in pending]
+
+    converted = 0
+    for (input_file, output_file, _, _), (_, error) in zip(pending, results):
+        if error is None:
+            manifest[os.path.basename(output_file)] = keys[os.path.basename(output_file)]
+            converted += 1
+        else:
+            failures.append((input_file, error))
+
+    with tempfile.NamedTemporaryFile(mode="w", dir=output_dir, delete=False) as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    copy_output_mode(f.name, manifest_path)
+    os.replace(f.name, manifest_path)
+
+    print("converted {} file(s), skipped {} unchanged, {} failed".format(converted, skipped, len(failures)))
+
+    return failures
+
+
+def _get_mtime(filepath):
+    try:
+        return os.stat(filepath).st_mtime
+    except OSError:
+        return None
+
+
+def watch_and_convert(jobs, file_type="dot", poll_interval=0.1, debounce=0.2, split_regions=False, **dot_options):
+    """
+    Converts yaml statechart files, then watches them and re-exports every file that changes, until interrupted.
+    Bursts of saves are debounced, and the content hash and dot source of every file are kept in memory, so a file
+    whose content or dot source did not change is neither parsed nor laid out again.
+
+    :param list jobs: Pairs of input yaml file and output file.
+    :param float poll_interval: Seconds between checks for modified files.
+    :param float debounce: Seconds a modified file must stay unchanged before it is converted.
+    :param bool split_regions: See render_statechart.
+    :param dot_options: Keyword arguments of export_to_dot.
+    """
+    hashes = {}
+    dots = {}
+    mtimes = {}
+
+    def convert(input_file, output_file):
+        with open(input_file, "rb") as f:
+            content = f.read()
+        content_hash = hashlib.sha1(content).hexdigest()
+        if hashes.get(input_file) == content_hash:
+            return False
+
+        sc = _load_statechart_content(content)
+
+        if file_type == "puml":
+            from sismic.io import export_to_plantuml
+
+            dot = export_to_plantuml(sc)
+        else:
+            dot = export_to_dot(sc, **dot_options)
+        if dots.get(input_file) == dot:
+            hashes[input_file] = content_hash
+            return False
+
+        if file_type in ("dot", "puml"):
+            data = dot.encode("utf-8")
+        else:
+            data = render_statechart(sc, file_type, split_regions=split_regions, **dot_options)
+        with tempfile.NamedTemporaryFile(dir=os.path.dirname(os.path.abspath(output_file)), delete=False) as f:
+            f.write(data)
+        copy_output_mode(f.name, output_file)
+        os.replace(f.name, output_file)
+        # Set only now, so that a file that failed to convert is converted again even if it doesn't change.
+        hashes[input_file] = content_hash
+        dots[input_file] = dot
+        return True
+
+    print("watching {} file(s), press Ctrl+C to stop".format(len(jobs)))
+    try:
+        while True:
+            changed = [job for job in jobs if _get_mtime(job[0]) != mtimes.get(job[0])]
+            if not changed:
+                time.sleep(poll_interval)
+                continue
+
+            # Wait for a quiet period, so that an editor saving several times in a row triggers a single export.
+            stamps = dict((input_file, _get_mtime(input_file)) for input_file, _ in changed)
+            while True:
+                time.sleep(debounce)
+                new_stamps = dict((input_file, _get_mtime(input_file)) for input_file, _ in changed)
+                if new_stamps == stamps:
+                    break
+                stamps = new_stamps
+
+            for input_file, output_file in changed:
+                mtimes[input_file] = stamps[input_file]
+                if stamps[input_file] is None:
+                    continue
+
+                start = time.time()
+                try:
+                    if convert(input_file, output_file):
+                        print("updated {} in {:.3f}s".format(output_file, time.time() - start))
+                except Exception as e:
+                    print("failed to convert {}: {}: {}".format(input_file, type(e).__name__, e), file=sys.stderr)
+    except KeyboardInterrupt:
+        pass
+
+
 def main():
-    global global_config
+    global global_config, cache_dir, debug_dump_dir
 
     parser = argparse.ArgumentParser()
-    parser.add_argument("input_file", type=str, help="Path to input yaml file.")
+    parser.add_argument("input_files", type=str, nargs="+", metavar="input_file",
+                        help="Path to input yaml file. With -d, any number of paths or glob patterns.")
 
     group = parser.add_mutually_exclusive_group(required=True)
     group.add_argument('-it', '--interactive', action="store_true", dest="interactive",
                        help="Runs input file in a browser.")
-    group.add_argument('-o', type=str, dest="output_file", help="Path to output dot file.")
+    group.add_argument('-o', type=str, dest="output_file", help="Path to output dot file, or - for stdout.")
+    group.add_argument('-d', '--output-dir', type=str, dest="output_dir",
+                       help="Directory to write one output file per input file to.")
+    group.add_argument('--static-site', type=str, dest="static_site", metavar="DIR",
+                       help="Writes a static html site to DIR, with an svg of every configuration reachable when all "
+                            "guards are true, and buttons that trigger events.")
 
     parser.add_argument('-T', type=str, default="dot", dest="file_type",
                         help="File type for output, if not in interactive mode. "
@@ -628,32 +3042,141 @@ def main():
 
     parser.add_argument("--trans-font-size", type=int, default=14,
                         help="Set font size of text on transitions. Default: 14.")
+
+    parser.add_argument("--focus", type=str, default=None,
+                        help="Only show this state and its descendants. Transitions to or from other states end at "
+                             "boundary ports.")
+    parser.add_argument("--max-depth", type=int, default=None,
+                        help="Number of levels shown below the focused state, or below the root state. Composite "
+                             "states at the last level are shown as a single node. Default: all levels.")
+    parser.add_argument("--split-regions", action="store_true",
+                        help="For svg output of statecharts whose root state is orthogonal, lay out each region "
+                             "separately and in parallel, and place the regions side by side.")
+    parser.add_argument("--lean-labels", action="store_true",
+                        help="Label transitions with their event only, and put their guard and action in a tooltip. "
+                             "Tooltips show in svg output opened in a browser.")
+    parser.add_argument("--collapse-inactive", action="store_true",
+                        help="In interactive mode, show composite states with no active descendant as a single "
+                             "node.")
+
+    parser.add_argument("--layout-timeout", type=float, default=None, metavar="SECONDS",
+                        help="In interactive mode, when laying out takes longer than this in total, kill dot "
+                             "and show a cheaper layout instead, and start from it for the next images: "
+                             "without labels, then with inactive states collapsed, then with "
+                             "straight edges.")
+    parser.add_argument("--prerender", action="store_true",
+                        help="In interactive mode, render all reachable configurations in the background, at startup "
+                             "and when display options change, so that later pages don't wait for dot. Guards are "
+                             "ignored when finding reachable configurations.")
+    parser.add_argument("--precompile", action="store_true",
+                        help="In interactive mode, compile all guards, actions and contracts when the statechart is "
+                             "loaded, and report syntax errors up front.")
+
+    parser.add_argument("--scenario", type=str, default=None,
+                        help="With -o, run the events of this JSON file on the statechart, without a browser and on "
+                             "a simulated clock, and export only the final configuration. Events are names, or "
+                             "objects with a name, and optional parameters and delay in seconds.")
+    parser.add_argument("--trace", type=str, default=None,
+                        help="With --scenario, path to write the interpreter metaevents to, as JSON lines.")
+    parser.add_argument("--stats", type=str, default=None,
+                        help="With --scenario, path to write statistics and timings of the run to, as JSON.")
+
+    parser.add_argument("--debug-dump", type=str, default=debug_dump_dir, metavar="DIR",
+                        help="Write a copy of every dot document rendered in interactive mode to DIR, named by its "
+                             "content hash. Can also be set with the SISMIC_VIZ_DEBUG_DIR environment variable.")
+
+    parser.add_argument("-j", "--jobs", type=int, default=None,
+                        help="Number of worker processes used with -d. Default: number of CPUs.")
+    parser.add_argument("--force", action="store_true",
+                        help="With -d, convert all input files, even those unchanged since the last run.")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="Always parse and render input files, instead of reusing statecharts and images "
+                             "cached in {}. "
+                             "The cache directory can be set with the SISMIC_VIZ_CACHE_DIR environment "
+                             "variable.".format(cache_dir))
+    parser.add_argument("--watch", action="store_true",
+                        help="With -o or -d, keep running and re-export input files whenever they change.")
     args = parser.parse_args()
 
-    if args.interactive:
-        global_config["include_guards"] = args.include_guards
-        global_config["include_actions"] = args.include_actions
-        global_config["edge_fontsize"] = args.trans_font_size
-        global_config["file_type"] = args.file_type
+    if args.no_cache:
+        cache_dir = None
+    debug_dump_dir = args.debug_dump
 
-        run_interactive(args.input_file)
-    else:
-        sc = import_from_yaml(filepath=args.input_file)
+    if args.output_dir is None and len(args.input_files) > 1:
+        parser.error("multiple input files require -d/--output-dir")
 
-        if args.file_type == "puml":
-            export_to_plantuml(sc, filepath=args.output_file)
-        else:
-            dot = export_to_dot(sc=sc, include_guards=args.include_guards, include_actions=args.include_actions,
-                                edge_fontsize=args.trans_font_size)
+    dot_options = {
+        "include_guards": args.include_guards,
+        "include_actions": args.include_actions,
+        "edge_fontsize": args.trans_font_size,
+        "focus": args.focus,
+        "max_depth": args.max_depth,
+        "lean_labels": args.lean_labels,
+    }
 
-            if args.file_type == "dot":
-                open(args.output_file, "w").write(dot)
+    if (args.trace or args.stats) and not args.scenario:
+        parser.error("--trace and --stats require --scenario")
+
+    # Errors of dot and plantuml are reported as messages, rather than as tracebacks.
+    try:
+        if args.static_site is not None:
+            if args.watch:
+                parser.error("--static-site can't be used with --watch")
+            count, complete = export_static_site(args.input_files[0], args.static_site, jobs=args.jobs,
+                                                 split_regions=args.split_regions, **dot_options)
+            if not complete:
+                print("exported only the first {} reachable configurations".format(count), file=sys.stderr)
+        elif args.scenario:
+            if args.output_file is None or args.watch:
+                parser.error("--scenario requires -o, and can't be used with --watch")
+            if args.file_type == "puml":
+                parser.error("--scenario can't export puml")
+            run_scenario(args.input_files[0], args.scenario, args.output_file, file_type=args.file_type,
+                         trace_file=args.trace, stats_file=args.stats, split_regions=args.split_regions,
+                         **dot_options)
+        elif args.watch:
+            if args.interactive:
+                parser.error("--watch requires -o or -d")
+            if args.output_file == "-":
+                parser.error("--watch can't write to stdout")
+
+            input_files = expand_input_files(args.input_files)
+            if args.output_dir is None:
+                jobs = [(input_files[0], args.output_file)]
             else:
-                with tempfile.NamedTemporaryFile() as f:
-                    f.write(dot)
-                    f.flush()
-                    os.system("dot -T{file_type} {inpath} -o {outpath}".format(file_type=args.file_type, inpath=f.name,
-                                                                               outpath=args.output_file))
+                if not os.path.isdir(args.output_dir):
+                    os.makedirs(args.output_dir)
+                jobs = [(input_file, os.path.join(args.output_dir, get_output_name(input_file, args.file_type)))
+                        for input_file in input_files]
+
+            watch_and_convert(jobs, file_type=args.file_type, split_regions=args.split_regions, **dot_options)
+        elif args.interactive:
+            global_config["include_guards"] = args.include_guards
+            global_config["include_actions"] = args.include_actions
+            global_config["edge_fontsize"] = args.trans_font_size
+            global_config["focus"] = args.focus
+            global_config["max_depth"] = args.max_depth
+            global_config["collapse_inactive"] = args.collapse_inactive
+            global_config["lean_labels"] = args.lean_labels
+            global_config["split_regions"] = args.split_regions
+            global_config["file_type"] = args.file_type
+            global_config["precompile"] = args.precompile
+            global_config["layout_timeout"] = args.layout_timeout
+            global_config["prerender"] = args.prerender
+
+            run_interactive(args.input_files[0])
+        elif args.output_dir is not None:
+            failures = convert_batch(expand_input_files(args.input_files), args.output_dir, file_type=args.file_type,
+                                     jobs=args.jobs, force=args.force, split_regions=args.split_regions, **dot_options)
+            for input_file, error in failures:
+                print("failed to convert {}: {}".format(input_file, error), file=sys.stderr)
+            if failures:
+                sys.exit(1)
+        else:
+            convert_file(args.input_files[0], args.output_file, file_type=args.file_type,
+                         split_regions=args.split_regions, **dot_options)
+    except RenderError as e:
+        parser.exit(1, "{}: error: {}\n".format(parser.prog, e))
 
 
 if __name__ == '__main__':
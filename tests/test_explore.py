@@ -0,0 +1,38 @@
+import copy
+
+import pytest
+from sismic.interpreter import Interpreter
+
+import sismic_viz
+from benchmarks.generator import generate_statechart
+
+
+def explore_with_interpreter(sc):
+    """
+    Finds the configurations reachable by sending every event to a running interpreter.
+    """
+    events = sorted(set(transition.event for transition in sc.transitions if transition.event))
+    interp = Interpreter(sc)
+    interp.execute()
+
+    found = {frozenset(interp.configuration): interp}
+    pending = [interp]
+    while pending:
+        current = pending.pop()
+        for event in events:
+            interp = copy.deepcopy(current)
+            interp.queue(event).execute()
+            configuration = frozenset(interp.configuration)
+            if configuration not in found:
+                found[configuration] = interp
+                pending.append(interp)
+    return set(found)
+
+
+@pytest.mark.parametrize("regions", [0, 2])
+@pytest.mark.parametrize("seed", range(10))
+def test_explore_without_guards_is_exact(regions, seed):
+    sc = generate_statechart(width=3, depth=2, regions=regions, label_length=0, seed=seed)
+    successors, complete = sismic_viz.explore_configurations(sc)
+    assert complete
+    assert set(successors) == explore_with_interpreter(sc)
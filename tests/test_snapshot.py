@@ -0,0 +1,122 @@
+import math
+
+from sismic.io import import_from_yaml
+from sismic.interpreter import Interpreter
+
+import sismic_viz
+
+statechart = """statechart:
+  name: Import
+  preamble: |
+    import math
+    x = 0
+    items = []
+  root state:
+    name: root
+    initial: a
+    states:
+    - name: a
+      transitions:
+      - target: b
+        event: go
+        action: "x = math.floor(x + 1.5); items.append(x)"
+    - name: b
+      transitions:
+      - target: a
+        event: back
+"""
+
+
+def get_interpreter():
+    interp = Interpreter(import_from_yaml(text=statechart))
+    interp.execute()
+    return interp
+
+
+def test_snapshot_with_import_in_preamble():
+    interp = get_interpreter()
+    snapshot = sismic_viz.take_snapshot(interp)
+    assert snapshot.context["math"] is math
+
+    interp.queue("go").execute()
+    assert snapshot.context["items"] == []
+
+    restored = sismic_viz.restore_snapshot(snapshot)
+    restored.queue("go").execute()
+    assert restored.configuration == ["root", "b"]
+    assert restored.context["items"] == [1]
+    assert snapshot.context["items"] == []
+
+
+def test_checkpoints_with_import_in_preamble():
+    interp = get_interpreter()
+    checkpoints = sismic_viz.Checkpoints(full_every=2)
+    checkpoints.push(interp, "start", 0)
+    for event in ["go", "back", "go"]:
+        interp.queue(event).execute()
+        checkpoints.push(interp, event, 0)
+    assert interp.context["items"] == [1, 2]
+
+    restored = checkpoints.restore(1)
+    assert restored.configuration == ["root", "b"]
+    assert restored.context["items"] == [1]
+    assert restored.context["math"] is math
+
+
+def test_checkpoints_store_changed_values_only():
+    interp = get_interpreter()
+    interp.context.update(("v{}".format(ind), ind) for ind in range(1000))
+    checkpoints = sismic_viz.Checkpoints()
+    checkpoints.push(interp, "start", 0)
+    interp.queue("go").execute()
+    checkpoints.push(interp, "go", 0)
+
+    assert sorted(checkpoints._entries[1]["changed"]) == ["items", "x"]
+    assert checkpoints._entries[1]["deleted"] == []
+
+
+def test_snapshot_keeps_compiled_code():
+    interp = get_interpreter()
+    interp.queue("go").execute()
+    evaluator = interp._evaluator
+    assert evaluator._executable_code
+
+    snapshot = sismic_viz.take_snapshot(interp)
+    assert snapshot._evaluator._executable_code is evaluator._executable_code
+    assert snapshot._evaluator._evaluable_code is evaluator._evaluable_code
+
+    restored = sismic_viz.restore_snapshot(snapshot)
+    assert restored._evaluator._executable_code is evaluator._executable_code
+    assert restored._evaluator._evaluable_code is evaluator._evaluable_code
+
+
+def test_checkpoints_keep_compiled_code():
+    interp = get_interpreter()
+    executable_code = interp._evaluator._executable_code
+    checkpoints = sismic_viz.Checkpoints()
+    checkpoints.push(interp, "start", 0)
+    interp.queue("go").execute()
+    checkpoints.push(interp, "go", 0)
+    assert executable_code
+
+    restored = checkpoints.restore(0)
+    assert restored._evaluator._executable_code is executable_code
+
+
+def test_precompiled_code_survives_reset(tmp_path, monkeypatch):
+    filepath = tmp_path / "import.yaml"
+    filepath.write_text(statechart)
+    monkeypatch.setattr(sismic_viz, "yaml_filepath", str(filepath))
+    monkeypatch.setattr(sismic_viz, "cache_dir", None)
+    monkeypatch.setitem(sismic_viz.global_config, "precompile", True)
+    monkeypatch.setattr(sismic_viz, "interp", None)
+
+    interp = sismic_viz.create_interp()
+    interp.execute()
+    assert interp._evaluator._executable_code is sismic_viz.compiled_code["exec"]
+    monkeypatch.setattr(sismic_viz, "interp_snapshot", sismic_viz.take_snapshot(interp))
+
+    sismic_viz.reset_interp()
+    assert sismic_viz.interp is not interp
+    assert sismic_viz.interp._evaluator._executable_code is sismic_viz.compiled_code["exec"]
+    assert sismic_viz.interp._evaluator._evaluable_code is sismic_viz.compiled_code["eval"]